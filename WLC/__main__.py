@@ -24,6 +24,7 @@ def arguments():
     parser.add_argument("-ip", "--dockerip", help="Docker daemon IP")
     parser.add_argument("-a", "--annotate", action="store_true", default=False, help="Ask user to annotate images")
     parser.add_argument("-lg", "--language", default='python3', help="Which language to execute code in.")
+    parser.add_argument("-v", "--video", help="Video file or directory of frames to recognize continuously")
 
     args, unknown = parser.parse_known_args()
     show_gui = args.gui
@@ -35,6 +36,7 @@ def arguments():
     docker_ip = args.dockerip
     annotate = args.annotate
     language = args.language
+    video = args.video
 
     if debug_mode:
         LOGGER.setLevel(logging.DEBUG)
@@ -49,17 +51,28 @@ def arguments():
     - docker_ip: %s
     - annotate: %s
     - language: %s
-    """, show_gui, show_pic, show_line, show_word, show_character, debug_mode, docker_ip, annotate, language)
+    - video: %s
+    """, show_gui, show_pic, show_line, show_word, show_character, debug_mode, docker_ip, annotate, language, video)
 
-    return show_gui, show_pic, show_line, show_word, show_character, docker_ip, annotate, language
+    return show_gui, show_pic, show_line, show_word, show_character, docker_ip, annotate, language, video
 
 
 def main():
 
-    show_gui, show_pic, show_line, show_word, show_character, docker_ip, annotate, language = arguments()
+    show_gui, show_pic, show_line, show_word, show_character, docker_ip, annotate, language, video = arguments()
 
     picture_path = None
 
+    if video:
+        LOGGER.info("Recognizing %s continuously", video)
+        pictures = Camera().capture_continuous(video, show_pic, show_line, show_word, show_character, annotate)
+        executor = CodeExecutor("haskell" if language.lower() == 'haskell' else "python3", docker_ip,
+                                DEFAULT_DOCKER_PORT)
+
+        for code, fixed_code in executor.process_pictures(pictures):
+            LOGGER.info("Board changed, fixed code: \n%s\n", fixed_code)
+        return
+
     if show_gui:
         LOGGER.info("Setting up GUI of the application")
         root = tk.Tk()
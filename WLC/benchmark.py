@@ -2,15 +2,20 @@ import argparse
 import logging
 import re
 import os
+import time
 
 from os.path import isfile, join
 
 from WLC.code_executor.code_executor import CodeExecutor
+from WLC.code_fixing.code_fixer import CodeFixer
+from WLC.code_fixing.rule_stats import RuleStats
 from WLC.image_processing.camera import Camera
+from WLC.ocr.picture_ocr import PictureOCR
 from WLC.utils.formatting import FORMAT
 from WLC.utils.path import get_full_path
 
 import editdistance
+from image_segmentation.preprocessor import Preprocessor
 
 logging.basicConfig(format=FORMAT)
 LOGGER = logging.getLogger()
@@ -20,10 +25,12 @@ def arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--language", default="all", help="Choose which language to run tests for. Defaults to \
                         all languages")
+    parser.add_argument("-r", "--rules", action="store_true", default=False, help="Also benchmark fixing the examples \
+                        with the rules in their compiled order and in the order profiled on the examples")
 
     args, unknown = parser.parse_known_args()
 
-    return args.language
+    return args.language, args.rules
 
 
 def _get_expected_code(file_name):
@@ -55,6 +62,54 @@ def benchmark_file(file_name, language="python3"):
     return accuracy, accuracy_fixed, length
 
 
+def _example_files(language):
+    directory = get_full_path('assets/examples/images/{}/'.format(language))
+    return [join(directory, f) for f in sorted(os.listdir(directory)) if isfile(join(directory, f)) and
+            not f.startswith(".")]
+
+
+def _fix_examples(recognized):
+    CodeFixer.fix_cache.clear()
+    start = time.perf_counter()
+
+    fixed = [fixer(code, indents, poss_lines).fix() for fixer, code, indents, poss_lines in recognized]
+
+    return fixed, time.perf_counter() - start
+
+
+def run_rule_order_benchmarks(language="all"):
+    LOGGER.info('')
+    LOGGER.info('Testing the order of the fixer rules:')
+
+    languages = ["python3", "haskell"] if language.lower() == "all" else [language.lower()]
+    recognized = []
+
+    for example_language in languages:
+        fixer = CodeExecutor(example_language).fixer
+
+        for file_path in _example_files(example_language):
+            image = Preprocessor().process(Camera().read_file(file_path, None))
+            code, indents, poss_lines = PictureOCR(image).get_code()
+            recognized.append((fixer, code.lower(), indents, poss_lines))
+
+    # The first run profiles the rules on the examples.
+    stats = RuleStats(record=True)
+    CodeFixer.rule_stats = stats
+    _fix_examples(recognized)
+    stats.record = False
+
+    CodeFixer.prioritize_rules(RuleStats())
+    fixed_compiled, time_compiled = _fix_examples(recognized)
+
+    CodeFixer.prioritize_rules(stats)
+    fixed_profiled, time_profiled = _fix_examples(recognized)
+
+    LOGGER.info('Same fixed code: %s, Compiled order: %.3fs, Profiled order: %.3fs, Speedup: %.2fx',
+                fixed_compiled == fixed_profiled, time_compiled, time_profiled, time_compiled / time_profiled)
+
+    return fixed_compiled == fixed_profiled, time_compiled, time_profiled
+
+
 def run_benchmarks(language="all"):
     LOGGER.info('=== Whiteboard Live Coding Benchmarking ===')
     LOGGER.info('Uses Levenshtein distance to calculate the difference and then uses that to calculate accuracy.')
@@ -102,6 +157,9 @@ def run_benchmarks(language="all"):
 
 
 if __name__ == '__main__':
-    language = arguments()
+    language, rules = arguments()
     LOGGER.setLevel(logging.INFO)
     run_benchmarks(language)
+
+    if rules:
+        run_rule_order_benchmarks(language)
@@ -5,6 +5,7 @@ import os
 from hackerrank.HackerRankAPI import HackerRankAPI
 from image_segmentation.preprocessor import Preprocessor
 
+from ..image_processing.camera import changed_pixels
 from ..utils.azure import WLCAzure
 from ..ocr.picture_ocr import PictureOCR
 
@@ -20,18 +21,71 @@ class AbstractCodeExecutor:
         self.language = language
         self.fixer = fixer
         self.force_local = True
+        self.docker_url = None
 
         if ip and port:
-            self.client = docker.DockerClient(base_url="tcp://{}:{}".format(ip, port))
+            self.docker_url = "tcp://{}:{}".format(ip, port)
+            self.client = docker.DockerClient(base_url=self.docker_url)
             self.force_local = False
 
     def process_picture(self, picture_in):
+        *_, processed = self.stream_picture(picture_in)
+        return processed['unfixed'], processed['fixed']
+
+    def stream_picture(self, picture_in, previous_state=None):
+        """
+        Recognizes the picture line by line and hands every line to the fixer as soon as it is recognized, so that the
+        fixer analyses the code while the rest of the lines are still being recognized.
+
+        :param picture_in: Picture with the code
+        :param previous_state: Fix state of an earlier picture of the same board, its unchanged lines are not fixed
+                               again
+        :return: Generator of {'line', 'indent', 'unfixed'} dicts for every recognized line, followed by a single
+                 {'unfixed', 'fixed', 'truncated', 'state'} dict with the whole code once it is fixed. Truncated lists
+                 the numbers of the lines whose fix ran out of time, state is the fix state to pass with the next
+                 picture.
+        """
         image = Preprocessor().process(picture_in)
-        code, indents, poss_lines = PictureOCR(image).get_code()
-        code = code.lower()
-        fixed_code = self.fixer(code, indents, poss_lines).fix()
+        fixer = self.fixer('', [], {}, previous_state=previous_state)
 
-        return code, fixed_code
+        for line_n, (indent, line, poss_line) in enumerate(PictureOCR(image).stream_code()):
+            line = line.lower()
+            fixer.add_line(indent, line, poss_line)
+            yield {'line': line_n + 1, 'indent': indent, 'unfixed': line}
+
+        fixed = fixer.fix()
+        truncated = [line_n + 1 for line_n in sorted(fixer.truncated_lines)]
+
+        yield {'unfixed': fixer.code, 'fixed': fixed, 'truncated': truncated, 'state': fixer.fix_state}
+
+    def process_pictures(self, pictures_in):
+        """
+        Processes a sequence of pictures of the same board, e.g. from Camera.capture_continuous. Lines whose region did
+        not change since the previous picture are not segmented and recognized again, lines recognized the same way
+        as in the previous picture are not fixed again.
+
+        :param pictures_in: Pictures of the board in the order they were taken
+        :return: Generator of (code, fixed_code) for every picture
+        """
+        previous_image = None
+        previous_lines = {}
+        previous_state = None
+
+        for picture_in in pictures_in:
+            image = Preprocessor().process(picture_in)
+            picture_ocr = PictureOCR(image, previous_lines=previous_lines,
+                                     changed=changed_pixels(previous_image, image.get_image()))
+
+            code, indents, poss_lines = picture_ocr.get_code()
+            code = code.lower()
+            fixer = self.fixer(code, indents, poss_lines, previous_state=previous_state)
+            fixed_code = fixer.fix()
+
+            previous_image = image.get_image()
+            previous_lines = picture_ocr.recognized_lines
+            previous_state = fixer.fix_state
+
+            yield code, fixed_code
 
     def execute_code_img(self, picture_in):
         code, fixed_code = self.process_picture(picture_in)
@@ -42,16 +96,30 @@ class AbstractCodeExecutor:
         LOGGER.info("Errors: \n%s\n", errors)
         return code, fixed_code, result, errors
 
-    def execute_code(self, code):
+    def execute_code(self, code, tiered=False):
+        """
+        :param code: Code to execute
+        :param tiered: Only look for the errors which are found instantly, e.g. syntax errors, the slower checks are
+                       left to check_errors_in_background
+        :return: (output, errors)
+        """
         LOGGER.info("Executing code: \n%s\n", code)
 
         if self.force_local:
-            result, errors = self.execute_local(code)
+            result, errors = self.execute_local(code, tiered)
         else:
-            result, errors = self.execute_sandbox(code)
+            result, errors = self.execute_sandbox(code, tiered)
 
         return result, errors
 
+    def check_errors_in_background(self, code):
+        """
+        Starts the slower error checks which execute_code skips when it is tiered.
+
+        :return: Future of the errors or None if the language has no slower checks
+        """
+        return None
+
     def execute_tests(self, code, test_key):
         azure = WLCAzure()
         template_code, test_cases, expected_responses, hints = azure.get_tests_from_azure(test_key)
@@ -76,8 +144,8 @@ class AbstractCodeExecutor:
 
         return results
 
-    def execute_local(self, code):
+    def execute_local(self, code, tiered=False):
         raise NotImplemented()
 
-    def execute_sandbox(self, code):
+    def execute_sandbox(self, code, tiered=False):
         raise NotImplemented()
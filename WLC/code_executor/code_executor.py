@@ -14,17 +14,26 @@ class CodeExecutor:
     def process_picture(self, picture_in):
         return self.executor.process_picture(picture_in)
 
+    def process_pictures(self, pictures_in):
+        return self.executor.process_pictures(pictures_in)
+
+    def stream_picture(self, picture_in, previous_state=None):
+        return self.executor.stream_picture(picture_in, previous_state)
+
     def execute_code_img(self, picture_in):
         return self.executor.execute_code_img(picture_in)
 
-    def execute_code(self, code):
-        return self.executor.execute_code(code)
+    def execute_code(self, code, tiered=False):
+        return self.executor.execute_code(code, tiered)
+
+    def check_errors_in_background(self, code):
+        return self.executor.check_errors_in_background(code)
 
     def execute_tests(self, code, test_key):
         return self.executor.execute_tests(code, test_key)
 
-    def execute_local(self, code):
-        return self.executor.execute_local(code)
+    def execute_local(self, code, tiered=False):
+        return self.executor.execute_local(code, tiered)
 
-    def execute_sandbox(self, code):
-        return self.executor.execute_sandbox(code)
+    def execute_sandbox(self, code, tiered=False):
+        return self.executor.execute_sandbox(code, tiered)
@@ -0,0 +1,102 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pylint import lint
+from pylint.typing import FileItem
+
+from ..code_executor.pylint_reporter import CustomJSONReporter
+
+# Path the checked code is reported under, no file is read or written there.
+SOURCE_PATH = 'main.py'
+
+_code_linter = None
+_code_linter_lock = threading.Lock()
+# Checks are serialized by the linter anyway, a single thread keeps them from piling up in front of its lock.
+_background_checks = ThreadPoolExecutor(1)
+
+
+def code_linter():
+    """
+    :return: Linter of the process, created the first time it is needed and then reused
+    """
+    global _code_linter
+
+    with _code_linter_lock:
+        if _code_linter is None:
+            _code_linter = CodeLinter()
+
+        return _code_linter
+
+
+def check_in_background(code):
+    """
+    :return: Future of the error dicts of the code, checked by the linter of the process in a background thread
+    """
+    return _background_checks.submit(lambda: code_linter().check_code(code))
+
+
+def syntax_errors(code):
+    """
+    Checks only the syntax of the code with the built-in compiler, which takes microseconds instead of a pylint run.
+
+    :param code: Source code to check
+    :return: List with the error dict of the first syntax error in the same format as CustomJSONReporter, empty if the
+             code compiles
+    """
+    try:
+        compile(code, SOURCE_PATH, 'exec', dont_inherit=True)
+    except SyntaxError as error:
+        return [{
+            'type': 'error',
+            'module': os.path.splitext(SOURCE_PATH)[0],
+            'obj': '',
+            'line': error.lineno or 1,
+            'column': error.offset or 0,
+            'path': SOURCE_PATH,
+            'symbol': 'syntax-error',
+            'message': str(error),
+            'message-id': 'E0001',
+        }]
+
+    return []
+
+
+class CodeLinter(lint.PyLinter):
+    """
+    PyLinter which checks code held in memory instead of files. The plugins are loaded once when it is created, it is
+    meant to live as long as the process and to check every program the process executes. Checks are serialized as
+    the linter keeps the state of the module it checks.
+    """
+
+    def __init__(self):
+        self.json_reporter = CustomJSONReporter()
+        super().__init__(reporter=self.json_reporter)
+        self.load_default_plugins()
+        self.error_mode()
+
+        self._source = None
+        self._lock = threading.Lock()
+
+    def check_code(self, code):
+        """
+        :param code: Source code to check
+        :return: List of the error dicts of CustomJSONReporter
+        """
+        with self._lock:
+            self.json_reporter.messages = []
+            self._source = code
+
+            try:
+                self.check([SOURCE_PATH])
+            finally:
+                self._source = None
+
+            return self.json_reporter.get_errors_json()
+
+    def _iterate_file_descrs(self, files_or_modules):
+        for filepath in files_or_modules:
+            yield FileItem(os.path.splitext(os.path.basename(filepath))[0], filepath, filepath)
+
+    def get_ast(self, filepath, modname, data=None):
+        return super().get_ast(filepath, modname, self._source)
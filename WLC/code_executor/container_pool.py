@@ -0,0 +1,169 @@
+import atexit
+import io
+import logging
+import os
+import queue
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger()
+
+SANDBOX_POOL_SIZE = int(os.environ.get('SANDBOX_POOL_SIZE', 2))
+# Seconds a program may run before it is killed.
+SANDBOX_TIMEOUT = int(os.environ.get('SANDBOX_TIMEOUT', 10))
+SANDBOX_MEMORY = os.environ.get('SANDBOX_MEMORY', '128m')
+SANDBOX_PIDS = int(os.environ.get('SANDBOX_PIDS', 64))
+# Number of cores a container may use, fractions are allowed.
+SANDBOX_CPUS = float(os.environ.get('SANDBOX_CPUS', 1))
+
+# Directory of the containers the code is copied to, it exists and is writable in every image.
+SANDBOX_DIRECTORY = '/tmp'
+# Exit codes of coreutils timeout when the program ran out of time.
+TIMEOUT_EXIT_CODES = (124, 137)
+# Exit code of a program killed with SIGKILL, which is also how the kernel stops programs over the memory limit.
+KILLED_EXIT_CODE = 137
+
+_container_pools = {}
+_container_pools_lock = threading.Lock()
+
+
+def container_pool(key, client, image, filename, command):
+    """
+    :param key: Identifies the pool, e.g. the Docker daemon and the language
+    :return: Container pool of the key, created and filled the first time it is needed and then reused by every executor
+    """
+    with _container_pools_lock:
+        if key not in _container_pools:
+            LOGGER.info("Starting %d %s sandbox containers.", SANDBOX_POOL_SIZE, image)
+            _container_pools[key] = ContainerPool(client, image, filename, command)
+            atexit.register(_container_pools[key].close)
+
+        return _container_pools[key]
+
+
+class ContainerPool:
+    """
+    Keeps containers of an image started and idle so that running code only has to copy it into one of them instead of
+    creating a container. Containers have no network, limited cpu, memory and processes and no capabilities. Every
+    container runs a single program, afterwards it is removed and a new one is started in the background.
+    """
+
+    def __init__(self, client, image, filename, command, size=SANDBOX_POOL_SIZE, timeout=SANDBOX_TIMEOUT):
+        """
+        :param client: Docker client, only containers.run, put_archive, exec_run and remove are used
+        :param image: Image of the containers
+        :param filename: Name of the file the code is copied to
+        :param command: Command which runs the file, as a list of arguments
+        :param size: Number of containers kept started
+        :param timeout: Seconds a program may run before it is killed
+        """
+        self.client = client
+        self.image = image
+        self.filename = filename
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+
+        self._ready = queue.Queue()
+        self._maintenance = ThreadPoolExecutor(1)
+        self._closed = False
+
+        for _ in range(size):
+            self._maintenance.submit(self._refill)
+
+    def run(self, code):
+        """
+        Runs the code in an idle container and replaces the container.
+
+        :param code: Source code to run
+        :return: (output, error) where output has the stdout and stderr of the program and error is 'timeout' if it
+                 ran out of time, 'killed' if it was killed before that, most likely for going over the memory limit,
+                 or None
+        """
+        container = self._acquire()
+
+        try:
+            container.put_archive(SANDBOX_DIRECTORY, _archive(self.filename, code))
+            start = time.monotonic()
+            exit_code, output = container.exec_run(['timeout', '-s', 'KILL', str(self.timeout)] + self.command,
+                                                   workdir=SANDBOX_DIRECTORY, user='nobody')
+            elapsed = time.monotonic() - start
+        finally:
+            self._maintenance.submit(self._remove, container)
+            self._maintenance.submit(self._refill)
+
+        return output.decode('utf-8', errors='replace'), _error(exit_code, elapsed, self.timeout)
+
+    def close(self):
+        """
+        Removes the idle containers and stops starting new ones.
+        """
+        self._closed = True
+        self._maintenance.shutdown()
+
+        while True:
+            try:
+                self._remove(self._ready.get_nowait())
+            except queue.Empty:
+                return
+
+    def _acquire(self):
+        try:
+            return self._ready.get_nowait()
+        except queue.Empty:
+            LOGGER.info("No idle %s sandbox container, starting one.", self.image)
+            return self._start()
+
+    def _refill(self):
+        if self._closed or self._ready.qsize() >= self.size:
+            return
+
+        try:
+            self._ready.put(self._start())
+        except Exception:
+            LOGGER.exception("Could not start a %s sandbox container.", self.image)
+
+    def _start(self):
+        return self.client.containers.run(self.image, ['sleep', 'infinity'], detach=True, network_disabled=True,
+                                          nano_cpus=int(SANDBOX_CPUS * 1e9), mem_limit=SANDBOX_MEMORY,
+                                          memswap_limit=SANDBOX_MEMORY,
+                                          pids_limit=SANDBOX_PIDS, cap_drop=['ALL'],
+                                          security_opt=['no-new-privileges'], labels={'wlc.sandbox': self.image})
+
+    def _remove(self, container):
+        try:
+            container.remove(force=True)
+        except Exception:
+            LOGGER.exception("Could not remove a %s sandbox container.", self.image)
+
+
+def _error(exit_code, elapsed, timeout):
+    """
+    :return: Why the program was stopped, see ContainerPool.run. Both the timeout and the memory limit kill the program,
+             only the time it ran tells them apart.
+    """
+    if exit_code in TIMEOUT_EXIT_CODES and elapsed >= timeout:
+        return 'timeout'
+
+    if exit_code == KILLED_EXIT_CODE:
+        return 'killed'
+
+    return None
+
+
+def _archive(filename, code):
+    """
+    :return: Bytes of a tar archive with the code as its only file, readable by any user
+    """
+    data = code.encode('utf-8')
+    archive = io.BytesIO()
+
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        info = tarfile.TarInfo(filename)
+        info.size = len(data)
+        info.mode = 0o444
+        tar.addfile(info, io.BytesIO(data))
+
+    return archive.getvalue()
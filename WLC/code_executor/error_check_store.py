@@ -0,0 +1,71 @@
+import json
+import sqlite3
+import time
+import uuid
+
+# Seconds the response of an error check is kept.
+DEFAULT_TTL = 30 * 60
+
+
+class ErrorCheckStore:
+    """
+    Responses of the background error checks by image key, kept in an sqlite database so that every worker process can
+    answer /api/errors and not only the one which runs the check. Every check is stored under a new id when it is
+    submitted, a check which finishes after a newer one of the same key was submitted is not stored.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def _connect(self):
+        # A connection per call, connections must not be shared with the worker processes forked after the import.
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute('CREATE TABLE IF NOT EXISTS error_checks '
+                   '(key TEXT PRIMARY KEY, id TEXT, response TEXT, stored REAL)')
+        return db
+
+    def submit(self, key, response):
+        """
+        Stores the response of a check which is still running, replacing the one of an earlier check of the key.
+
+        :return: Id of the check to pass to finish
+        """
+        check_id = uuid.uuid4().hex
+        now = time.time()
+        db = self._connect()
+
+        try:
+            db.execute('INSERT OR REPLACE INTO error_checks (key, id, response, stored) VALUES (?, ?, ?, ?)',
+                       (key, check_id, json.dumps(response), now))
+            db.execute('DELETE FROM error_checks WHERE stored < ?', (now - self.ttl,))
+        finally:
+            db.close()
+
+        return check_id
+
+    def finish(self, key, check_id, response):
+        """
+        Stores the final response of a check unless a newer check of the key was submitted since.
+        """
+        db = self._connect()
+
+        try:
+            db.execute('UPDATE error_checks SET response = ?, stored = ? WHERE key = ? AND id = ?',
+                       (json.dumps(response), time.time(), key, check_id))
+        finally:
+            db.close()
+
+    def get(self, key):
+        """
+        :return: The latest response stored for the key or None if there is none or it expired
+        """
+        db = self._connect()
+
+        try:
+            row = db.execute('SELECT response FROM error_checks WHERE key = ? AND stored >= ?',
+                             (key, time.time() - self.ttl)).fetchone()
+        finally:
+            db.close()
+
+        return json.loads(row[0]) if row else None
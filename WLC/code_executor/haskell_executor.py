@@ -12,7 +12,7 @@ class HaskellExecutor(AbstractCodeExecutor):
     def __init__(self, ip="", port=""):
         super().__init__("haskell", HaskellCodeFixer, ip, port)
 
-    def execute_local(self, code):
+    def execute_local(self, code, tiered=False):
         file_code = tempfile.NamedTemporaryFile(delete=False, suffix='.hs')
         file_code.write(code.encode('utf8'))
         file_code.close()
@@ -24,7 +24,7 @@ class HaskellExecutor(AbstractCodeExecutor):
 
         return out.decode("utf-8"), self._get_code_errors(err.decode("utf-8"))
 
-    def execute_sandbox(self, code):
+    def execute_sandbox(self, code, tiered=False):
         raise NotImplemented()
 
     def _get_code_errors(self, err):
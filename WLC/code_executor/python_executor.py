@@ -1,19 +1,24 @@
-import tempfile
 import os
-from pylint import lint
 
-from ..code_executor.pylint_reporter import CustomJSONReporter
+from ..code_executor.code_linter import code_linter, check_in_background, syntax_errors
 from ..code_fixing.python_code_fixer import PythonCodeFixer
 from ..code_executor.executor_error import ExecutorError
 from ..code_executor.redirected_std import redirected_std
 from ..code_executor.abstract_executor import AbstractCodeExecutor, LOGGER
+from ..code_executor.container_pool import container_pool
+
+SANDBOX_PYTHON_IMAGE = os.environ.get('SANDBOX_PYTHON_IMAGE', 'python')
 
 
 class PythonExecutor(AbstractCodeExecutor):
     def __init__(self, ip="", port=""):
         super().__init__("python3", PythonCodeFixer, ip, port)
 
-    def execute_local(self, code):
+        if not self.force_local:
+            self.pool = container_pool((self.docker_url, SANDBOX_PYTHON_IMAGE), self.client, SANDBOX_PYTHON_IMAGE,
+                                       'main.py', ['python', 'main.py'])
+
+    def execute_local(self, code, tiered=False):
         LOGGER.info("Executing locally (UNSAFE! use -ip parameter to run the code safely) . . .\n")
 
         stdout_prog = ""
@@ -29,33 +34,24 @@ class PythonExecutor(AbstractCodeExecutor):
             stdout_prog = self.NO_OUTPUT
 
         LOGGER.info("Output:\n%s\n", stdout_prog)
-        return stdout_prog, self._get_code_errors(code)
+        return stdout_prog, syntax_errors(code) if tiered else self._get_code_errors(code)
 
-    def execute_sandbox(self, code):
+    def execute_sandbox(self, code, tiered=False):
         LOGGER.info("Executing in sandbox . . .\n")
-        container = self.client.containers.run('python', 'python -c \"{}\"'.format(code), detach=True)
-        container.wait()
-
-        stdout_prog = container.logs(stdout=True).decode("utf-8")
+        stdout_prog, error = self.pool.run(code)
 
         if not stdout_prog:
             stdout_prog = self.NO_OUTPUT
 
         LOGGER.info("Output:\n%s\n", stdout_prog)
-        return stdout_prog, ExecutorError()
 
-    def _get_code_errors(self, code):
-        file_code = tempfile.NamedTemporaryFile(delete=False, suffix='.py')
-        file_code.write(code.encode('utf8'))
-        file_code.close()
-
-        json_reporter = CustomJSONReporter()
-        linter = lint.PyLinter(reporter=json_reporter)
-        linter.load_default_plugins()
-        linter.error_mode()
+        if tiered:
+            return stdout_prog, syntax_errors(code)
 
-        linter.check(file_code.name.replace('\\', '/'))
+        return stdout_prog, ExecutorError(error) if error else ExecutorError()
 
-        os.unlink(file_code.name)
+    def check_errors_in_background(self, code):
+        return check_in_background(code)
 
-        return json_reporter.get_errors_json()
+    def _get_code_errors(self, code):
+        return code_linter().check_code(code)
@@ -1,109 +1,414 @@
 import logging
 import sys
-from itertools import tee
-from math import log, floor, ceil
-
-import editdistance
-import regex
+import threading
+import time
+import types
+from itertools import takewhile, tee
+from math import floor, ceil
+from os import environ
+
+from ..code_fixing.fix_cache import FixCache, DEFAULT_CACHE_SIZE
+from ..code_fixing.fix_state import line_key
+from ..code_fixing.keyword_trie import keyword_trie
+from ..code_fixing.lattice import Lattice, LatticePattern, combined_pattern
+from ..code_fixing.permutations import most_probable_permutations
+from ..code_fixing.rule_stats import RuleStats
+from ..code_fixing.vocabulary import as_vocabulary
 
 LOGGER = logging.getLogger()
 
+FIX_CACHE_SIZE = int(environ.get('FIX_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+# Seconds add_line and fix() may take in total and seconds the search for the fix of one line may take, 0 for no limit.
+# Lines whose search runs out of time get the best fix found so far and are reported as truncated.
+FIX_TIME_BUDGET = float(environ.get('FIX_TIME_BUDGET', 0))
+FIX_LINE_TIME_BUDGET = float(environ.get('FIX_LINE_TIME_BUDGET', 0))
+
+# Number of the most probable permutations of a line or part of a line that are tried when matching it.
+FIX_PERMUTATIONS = int(environ.get('FIX_PERMUTATIONS', 256))
+
+# Optional path of the file with the stats of the rules, rules which could reach the same distance are tried in the
+# order they are most likely to win in according to it. The stats are only recorded if a path is given.
+FIX_RULE_STATS_PATH = environ.get('FIX_RULE_STATS_PATH')
+
+# Whether lines with several possible characters are matched against all of the rules at once with a CombinedPattern
+# instead of against one rule after the other.
+FIX_COMBINED_RULES = environ.get('FIX_COMBINED_RULES', '1') == '1'
+
+# Shortest timeout given to a regex, the regex module treats negative timeouts as no limit at all.
+MINIMUM_TIMEOUT = 0.001
+
+def _set_priorities(fixer_class, regexes, stats):
+    for r, _, _, _ in regexes:
+        r.priority = stats.priority(fixer_class.__name__, r.pattern)
+
 
 class CodeFixer:
     PERMUTATION_LENGTH = 3
     ALLOWED_DIFFERENCE = 0.25
 
-    def find_closest_match(self, poss_line, regexes):
+    # Compiled main and statement rules of every language, shared by all fixers of the process.
+    _compiled_rules = {}
+    _compiled_rules_lock = threading.Lock()
+
+    # Fixed fragments of lines, shared by all fixers of the process so repeated fragments are only fixed once.
+    fix_cache = FixCache(FIX_CACHE_SIZE)
+
+    # How often each rule wins, shared by all fixers of the process.
+    rule_stats = RuleStats(FIX_RULE_STATS_PATH)
+
+    # Names of the fix functions which add to the context, they are run in order before the other lines are fixed.
+    CONTEXT_FIXES = ()
+
+    maximum_permutations = FIX_PERMUTATIONS
+
+    # Set to False on a fixer to match lines against one rule after the other.
+    combined_rules = FIX_COMBINED_RULES
+
+    # Time budgets of the fixer, fixers set their own budgets and an empty set of truncated_lines in __init__. They also
+    # set fix_state to a new FixState and previous_state to the fix_state of an earlier run or None.
+    time_budget = FIX_TIME_BUDGET
+    line_time_budget = FIX_LINE_TIME_BUDGET
+    deadline = None
+    line_deadline = None
+    budget_line_n = None
+    truncations = 0
+    # Seconds of the total budget used by earlier calls to add_line.
+    budget_used = 0.0
+
+    def add_line(self, indent, line, poss_line):
         """
-        Finds the closest regex to the line provided looking at possible permutations of characters.
+        Adds a line which has just been recognized and analyzes it straight away, this way the analysis can run while
+        the rest of the picture is still being recognized and fix() only has to fix the lines.
 
+        :param indent: Indentation of the line
+        :param line: Recognized code of the line without the indentation
         :param poss_line: Possible characters that make up the line. Type: [[Char]]
-        :param regexes: Compiled list of regexes
-        :return: The closest match and the functions used to analyze and fix the line
         """
-        distance = sys.maxsize
-        closest = None, None, None
-        permutations_main = self.permutations(poss_line)
-        LOGGER.debug('Permutating.')
+        self.resume_budget()
 
-        LOGGER.debug("Checking {} regex fixes for a good match.".format(len(regexes)))
-        for r, fixed, analyze, fix in regexes:
-            # duplicate generator to reuse it at each iteration.
-            permutations, permutations_main = tee(permutations_main)
-            for possible in permutations:
-                match = r.match(possible)
+        line_n = len(self.indents)
+        code_line = "{indent}{code}".format(indent="  " * indent, code=line)
 
-                if match:
-                    # use fuzzy counts here
-                    if sum(match.fuzzy_counts) - fixed < distance:
-                        distance = sum(match.fuzzy_counts) - fixed
-                        closest = (match, analyze, fix)
+        self.code = "{}\n{}".format(self.code, code_line) if line_n else code_line
+        self.indents.append(indent)
+        self.poss_lines[line_n] = poss_line
 
-                        if sum(match.fuzzy_counts) == 0:
-                            return closest
+        try:
+            self.analyze_line(line_n)
+        finally:
+            self.pause_budget()
 
-        return closest
+    def memoized(self, kind, poss_chars, text, compute):
+        """
+        Returns the cached fix of a fragment of a line or computes and caches it. The key is made of the possible
+        characters of the fragment, its recognized text and the context_snapshot of the fixer.
+
+        :param kind: Name of the kind of fix, fragments fixed in different ways must not share results
+        :param poss_chars: Possible characters of the fragment. Type: [[Char]]
+        :param text: Text of the fragment as it was matched
+        :param compute: Function without arguments which fixes the fragment
+        :return: The fixed fragment
+        """
+        key = (type(self), kind, line_key(poss_chars, self.PERMUTATION_LENGTH), text, self.context_snapshot())
+        truncations = self.truncations
 
-    def permutation_count(self, poss_chars):
+        # Fixes cut short by the time budget are not cached, another fix of the fragment may have more time.
+        return self.fix_cache.get_or_compute(key, compute, lambda _: self.truncations == truncations)
+
+    def resume_budget(self):
+        """
+        Starts the total time budget or resumes it with the time left. The budget only runs while the fixer works, i.e.
+        during add_line and fix, the time spent waiting for the next line to be recognized does not count towards it.
         """
-        Calculates the number of permutations the algorithm would try to create without capping to see if it is
-        possible to try all of them or if caps should be applied.
+        if self.time_budget:
+            self.deadline = time.monotonic() + self.time_budget - self.budget_used
 
-        :param poss_chars: Characters that will be permuted
-        :return: The number of all permutations that would be created and number of characters that would be included
-                 in the permutations. If there is only one character in a slot then it wont be included in the length
-                 because it cannot be permuted.
+    def pause_budget(self):
+        """
+        Stops the total time budget until it is resumed and keeps how much of it has been used.
         """
-        perm_count = 1
-        perm_length = 0
+        if self.deadline is not None:
+            self.budget_used = self.time_budget - (self.deadline - time.monotonic())
+            self.deadline = None
 
-        for i in range(len(poss_chars)):
-            if len(poss_chars[i]) > 1:
-                perm_length += 1
-                perm_count *= len(poss_chars[i][:self.PERMUTATION_LENGTH])
+    def start_line(self, line_n):
+        """
+        Starts the time budget of analyzing or fixing a line, it ends at the latest when the total budget ends.
+        """
+        self.budget_line_n = line_n
+        self.line_deadline = self.deadline
 
-        return perm_count, perm_length
+        if self.line_time_budget:
+            line_deadline = time.monotonic() + self.line_time_budget
+            self.line_deadline = line_deadline if self.deadline is None else min(line_deadline, self.deadline)
 
-    def generate_permutation_strings(self, poss_chars, perm_cap, perm_count, perm_length):
+    def out_of_time(self):
         """
-        Finds the most probable permutations of the line. If the count of possible permutations is higher than the cap
-        then it will only create a subset of the most probable permutations.
+        Checks the budget of the current line, if it has run out the line is marked as truncated.
 
-        :param poss_chars: Possible characters that make up the line
-        :param perm_cap: The maximum number of permutations that can be created by this function
-        :param perm_count: The number of permutations that would be created if left uncapped
-        :param perm_length: The number of characters that will be included in calculating the permutations
-        :return: Possible ways to write the line returned as a list of strings
+        :return: Whether the search for the fix of the line should stop and return the best result found so far
+        """
+        if self.line_deadline is None or time.monotonic() < self.line_deadline:
+            return False
+
+        self.truncate_line()
+        return True
+
+    def truncate_line(self):
+        """
+        Marks the current line as truncated, its fix was cut short by the time budget.
         """
-        if not poss_chars:
-            return ['']
+        self.truncated_lines.add(self.budget_line_n)
+        self.truncations += 1
 
-        if perm_count <= perm_cap:
-            current_perm_length = self.PERMUTATION_LENGTH
+    def remaining_time(self):
+        """
+        :return: Seconds left in the budget of the current line, None if it has no budget
+        """
+        if self.line_deadline is None:
+            return None
+
+        return max(self.line_deadline - time.monotonic(), MINIMUM_TIMEOUT)
+
+    def unfixed_line(self, line_n):
+        """
+        :return: The most probable characters of the line, used when no rule was matched before the budget ran out
+        """
+        return ''.join(chars[0] for chars in self.poss_lines[line_n] if chars)
+
+    def find_line_match(self, line_n):
+        """
+        Finds the closest main rule of a line, the match is reused if the previous state had a line with the same
+        possible characters.
+
+        :return: The closest match and the functions used to analyze and fix the line
+        """
+        key = line_key(self.poss_lines[line_n], self.PERMUTATION_LENGTH)
+
+        if self.previous_state is not None and key in self.previous_state.matches:
+            match, rule = self.previous_state.matches[key]
+            _, _, analyze, fix = self.rules_regexes[rule] if rule is not None else (None, None, None, None)
+            closest = match, analyze, fix
         else:
-            current_perm_length = floor(10 ** (log(perm_cap, 10) / perm_count))
+            closest = self.find_closest_match(self.poss_lines[line_n], self.rules_regexes)
+
+        if line_n not in self.truncated_lines:
+            match, _, fix = closest
+            self.fix_state.matches[key] = match, self.rule_index(fix) if fix else None
+
+        return closest
+
+    def fix_line(self, line_n, match, fix_func):
+        """
+        Fixes a line with the fix function of its closest match. The fix is reused if the previous state had a line
+        with the same possible characters fixed in the same context, lines whose fix adds to the context are always
+        fixed again.
+
+        :return: The fixed line
+        """
+        if fix_func is None:
+            return self.unfixed_line(line_n)
+
+        if getattr(fix_func, '__name__', None) in self.CONTEXT_FIXES:
+            return fix_func(match, self.poss_lines[line_n])
 
-        if len(poss_chars[0]) == 1:
-            permutations = self.generate_permutation_strings(poss_chars[1:], perm_cap, perm_count, perm_length)
+        key = self.fix_key(line_n)
+
+        if self.previous_state is not None and key in self.previous_state.fixed:
+            fixed = self.previous_state.fixed[key]
         else:
-            new_cap = perm_cap / len(poss_chars[0][:current_perm_length])
-            new_count = perm_count / len(poss_chars[0][:self.PERMUTATION_LENGTH])
-            permutations = self.generate_permutation_strings(poss_chars[1:], new_cap, new_count, perm_length - 1)
+            fixed = fix_func(match, self.poss_lines[line_n])
+
+        self.keep_fix(line_n, key, fixed)
+        return fixed
+
+    def fix_key(self, line_n):
+        return line_key(self.poss_lines[line_n], self.PERMUTATION_LENGTH), self.context_snapshot()
+
+    def keep_fix(self, line_n, key, fixed):
+        """
+        Stores the fix of a line in the fix state unless it was cut short by the time budget.
+        """
+        if line_n not in self.truncated_lines:
+            self.fix_state.fixed[key] = fixed
+
+    def rule_index(self, fix_func):
+        return [fix for _, _, _, fix in self.rules_regexes].index(fix_func)
+
+    def context_snapshot(self):
+        """
+        Should return a hashable summary of everything in the context which fixing a fragment can depend on.
+        """
+        return ()
+
+    def find_closest_match(self, poss_line, regexes):
+        """
+        Finds the closest regex to the line provided. The rules are matched against the lattice of possible characters
+        of the line so the permutations of the line do not have to be generated, only rules which cannot be matched
+        against a lattice are still tried on every permutation. Rules starting with a keyword that cannot be found at
+        the start of the line are skipped, so are rules which cannot beat the closest match found so far. When the time
+        budget of the line runs out the closest match found so far is returned.
+
+        :param poss_line: Possible characters that make up the line. Type: [[Char]]
+        :param regexes: Compiled list of regexes
+        :return: The closest match and the functions used to analyze and fix the line, all None if nothing matched
+        """
+        best = sys.maxsize, None
+        closest = None, None, None
+        lattice = Lattice(poss_line, self.PERMUTATION_LENGTH)
+        permutations_main = None
+        recording = self.rule_stats.record
+
+        bounds = keyword_trie(tuple(r for r, _, _, _ in regexes)).bounds(lattice)
+        candidates = [idx for idx, _ in bounds]
+
+        LOGGER.debug("Checking {} of {} regex fixes for a good match.".format(len(candidates), len(regexes)))
+        if self.combined_rules and lattice.ambiguous and lattice.complete and \
+                all(regexes[idx][0].supports_lattice for idx in candidates):
+            return self.find_combined_match(lattice, regexes, candidates)
+
+        # Rules are tried from the lowest distance they could reach, rules which could reach the same distance in the
+        # order of their priority. Ties between matches still go to the rule listed first, so the order only changes
+        # how soon the search can stop because no other rule can beat the closest match.
+        for lowest, _, idx in sorted((bound - regexes[idx][1], regexes[idx][0].priority, idx) for idx, bound in bounds):
+            if lowest > best[0]:
+                break
+
+            r, fixed, analyze, fix = regexes[idx]
+
+            if (lowest, idx) >= best:
+                continue
+
+            # Only checked when there is a rule left to try, so lines whose search finished are not marked truncated.
+            if self.out_of_time():
+                break
+
+            start = time.perf_counter()
+
+            try:
+                if r.supports_lattice:
+                    matches = [r.match(lattice, self.remaining_time())]
+                else:
+                    if permutations_main is None:
+                        LOGGER.debug('Permutating.')
+                        permutations_main = self.permutations(poss_line)
+
+                    # duplicate generator to reuse it at each iteration.
+                    permutations, permutations_main = tee(permutations_main)
+                    matches = (r.match(possible, self.remaining_time())
+                               for possible in takewhile(lambda _: not self.out_of_time(), permutations))
+
+                for match in matches:
+                    if match:
+                        # use fuzzy counts here
+                        if (sum(match.fuzzy_counts) - fixed, idx) < best:
+                            best = sum(match.fuzzy_counts) - fixed, idx
+                            closest = (match, analyze, fix)
+
+                            if sum(match.fuzzy_counts) - fixed == lowest:
+                                break
+            except TimeoutError:
+                # The regex alone used up the rest of the budget of the line.
+                self.truncate_line()
+                break
+
+            if recording:
+                self.rule_stats.tried(type(self).__name__, r.pattern, time.perf_counter() - start)
+
+        if recording and best[1] is not None:
+            self.rule_stats.won(type(self).__name__, regexes[best[1]][0].pattern)
 
-        return (char + permutation for permutation in permutations for char in poss_chars[0][:current_perm_length])
+        return closest
+
+    def find_combined_match(self, lattice, regexes, candidates):
+        """
+        Matches the lattice against all of the candidate rules at once, the rule is picked the same way as
+        find_closest_match picks it when it tries them one after the other.
+
+        :return: The closest match and the functions used to analyze and fix the line
+        """
+        if self.out_of_time():
+            return None, None, None
+
+        combined = combined_pattern(tuple(r for r, _, _, _ in regexes))
+        idx, match = combined.match(lattice, candidates, [fixed for _, fixed, _, _ in regexes])
+
+        if idx is None:
+            return None, None, None
+
+        _, _, analyze, fix = regexes[idx]
+        return match, analyze, fix
 
     def permutations(self, poss_chars):
         """
-        Finds the most probable permutations of the line while capping the maximum number of permutations.
+        Generates the most probable permutations of the line or part of a line, the most probable first. The
+        probabilities come from the OCR, characters without them are ranked by their order.
 
         :param poss_chars: Possible characters that make up the line
-        :return: Possible ways to write the line returned as a list of strings
+        :return: Possible ways to write the line as a generator of strings
+        """
+        return most_probable_permutations(poss_chars, self.PERMUTATION_LENGTH, self.maximum_permutations)
+
+    def compiled_rules(self):
+        """
+        Compiles the rules from define_rules only once per language and process. Every fixer gets the shared compiled
+        regexes bound to its own analyze and fix functions. The priorities of the rules are set from the rule stats.
+
+        :return: Compiled main rules and compiled statement rules of this fixer
         """
+        with CodeFixer._compiled_rules_lock:
+            if type(self) not in CodeFixer._compiled_rules:
+                self.define_rules()
 
-        perm_count, perm_length = self.permutation_count(poss_chars)
-        perm_cap = 2 ** 16
+                LOGGER.debug('Compiling main rules.')
+                rules_regexes = self.compile_regex(self.rules)
 
-        return self.generate_permutation_strings(poss_chars, perm_cap, perm_count, perm_length)
+                LOGGER.debug('Compiling statement rules.')
+                statements_regexes = self.compile_regex(self.statements)
+
+                _set_priorities(type(self), rules_regexes + statements_regexes, self.rule_stats)
+
+                CodeFixer._compiled_rules[type(self)] = (self._unbind_regexes(rules_regexes),
+                                                         self._unbind_regexes(statements_regexes))
+
+        rules_regexes, statements_regexes = CodeFixer._compiled_rules[type(self)]
+        return self._bind_regexes(rules_regexes), self._bind_regexes(statements_regexes)
+
+    @staticmethod
+    def prioritize_rules(stats):
+        """
+        Sets the priorities of the rules compiled so far from other rule stats, e.g. to compare orders of the rules.
+        """
+        with CodeFixer._compiled_rules_lock:
+            for fixer_class, compiled in CodeFixer._compiled_rules.items():
+                for regexes in compiled:
+                    _set_priorities(fixer_class, regexes, stats)
+
+    def _unbind_regexes(self, regexes):
+        """
+        Replaces the methods of this fixer by their functions so the compiled regexes can be bound to other fixers.
+        Other callables such as lambdas are kept as they are.
+        """
+        def unbind(func):
+            if getattr(func, '__self__', None) is self:
+                return func.__func__, True
+            return func, False
+
+        return [(r, difference, unbind(analyze), unbind(fix)) for r, difference, analyze, fix in regexes]
+
+    def _bind_regexes(self, regexes):
+        def bind(func, is_method):
+            return types.MethodType(func, self) if is_method else func
+
+        return [(r, difference, bind(*analyze), bind(*fix)) for r, difference, analyze, fix in regexes]
+
+    def define_rules(self):
+        """
+        Should fill self.rules and self.statements with quad-tuples (string to match, number of fixed, analysis_func,
+        fix_func).
+        """
+        raise NotImplementedError()
 
     def compile_regex(self, to_compile):
         """
@@ -111,7 +416,7 @@ class CodeFixer:
         also refer to other expressions that were listed before them because they get expanded.
 
         :param to_compile: List of rules that should get compiled into syntax expressions
-        :return: Compiled list of regexes
+        :return: Compiled list of regexes, each one can be matched against a string or a Lattice
         """
         regexes = []
 
@@ -121,12 +426,11 @@ class CodeFixer:
 
         for rule, fixed, analyze, fix in to_compile:
             difference = max(ceil(fixed * self.ALLOWED_DIFFERENCE), 0)
-            reg = '^(?e)((?:%s){e<=%s})$' % (rule, difference)
 
             for i in range(len(self.syntax)):
-                reg = reg.replace('({})'.format(self.syntax[i][0]), '({})'.format(self.syntax[i][1]))
+                rule = rule.replace('({})'.format(self.syntax[i][0]), '({})'.format(self.syntax[i][1]))
 
-            r = regex.compile(reg)
+            r = LatticePattern(rule, difference)
             regexes.append((r, difference, analyze, fix))
 
         regexes = sorted(regexes, key=lambda x: -x[1])
@@ -135,30 +439,41 @@ class CodeFixer:
 
     def levenshtein_closest(self, poss_chars, possibilities, allowed_difference=ALLOWED_DIFFERENCE):
         """
-        Finds one of the possible strings which is closest to a permutation of a line or part of a line. This is fairly
-        expensive when there are a lot of possibilities and permutations.
+        Finds one of the possible strings which is closest to a permutation of a line or part of a line. Only the
+        possibilities within the allowed edit distance of a permutation are looked at, they are found with the
+        vocabulary index so the possibilities should be a Vocabulary when the same ones are searched more than once.
 
         :param poss_chars: Possible characters to make up all of the permutations of the line/substring
         :param possibilities: Possible strings which should be matched to the closest permutation
         :param allowed_difference: Maximum percentage difference between closest match and one possibility
-        :return: The closest possibility to the provided line/substring and the levenshtein distance
+        :return: The closest possibility to the provided line/substring and the levenshtein distance. If the time budget
+                 of the line runs out the closest one found so far is returned.
         """
 
+        vocabulary = as_vocabulary(possibilities)
         permutations = self.permutations(poss_chars)
         LOGGER.debug('Permutating.')
         best = allowed_difference
         recommended = None
 
-        for permutation in permutations:
+        for count, permutation in enumerate(permutations):
+            # The first permutation is always searched, afterwards only while there is time left.
+            if count and self.out_of_time():
+                break
+
             if not recommended:
                 recommended = permutation
 
-            for possibility in possibilities:
-                distance = editdistance.eval(permutation, possibility) / (len(possibility) or 1)
+            # distance / len(possibility) < best can only hold for distances below this radius.
+            radius = floor(best * len(permutation) / (1 - best)) if best < 1 else None
+
+            for _, possibility, distance in vocabulary.search(permutation, radius):
+                distance = distance / (len(possibility) or 1)
 
                 if distance == 0:
                     return possibility, 0
                 elif distance < best:
                     recommended = possibility
                     best = distance
+
         return recommended, best
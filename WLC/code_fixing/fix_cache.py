@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 10000
+
+
+class FixCache:
+    """
+    Bounded LRU cache of fixed fragments of code shared by all of the fixers of the process. Keys have to contain
+    everything the fix depends on: the possible characters of the fragment and a snapshot of the context.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """
+        :param key: Hashable key of the fragment
+        :param compute: Function without arguments which fixes the fragment if it is not cached
+        :param cacheable: Function of the computed fix returning whether it may be cached, everything is by default
+        :return: The cached or newly computed fix
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+
+        # Computed outside of the lock, other threads can fix other fragments meanwhile.
+        fixed = compute()
+
+        if self.max_size > 0 and (cacheable is None or cacheable(fixed)):
+            with self._lock:
+                self._entries[key] = fixed
+                self._entries.move_to_end(key)
+
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return fixed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
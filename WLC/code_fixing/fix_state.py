@@ -0,0 +1,36 @@
+from ..code_fixing.lattice import probability_costs
+
+
+class FixState:
+    """
+    Closest matches and fixes of the lines of one run of a fixer, kept so that a later run on a retake of the same board
+    only has to match and fix the lines which changed. Lines are identified by their possible characters instead of
+    their numbers so lines which only moved are reused too.
+    """
+
+    def __init__(self, fixer_class):
+        # Class of the fixer which made the state, the rule indexes only mean something to fixers of that class.
+        self.fixer_class = fixer_class
+        # Line key -> (closest match, index of the main rule or None if nothing matched)
+        self.matches = {}
+        # (line key, context snapshot) -> fixed line
+        self.fixed = {}
+
+    def __len__(self):
+        return len(self.matches)
+
+
+def usable_state(state, fixer_class):
+    """
+    :return: The state if it was made by a fixer of the class, None otherwise, e.g. for a picture of the same board
+             which was fixed as another language
+    """
+    return state if state is not None and state.fixer_class is fixer_class else None
+
+
+def line_key(poss_chars, width):
+    """
+    :return: Hashable key of the possible characters of a line and their probability costs, only the first width
+             alternatives are used by fixers. The same characters ranked differently can be fixed differently.
+    """
+    return tuple((tuple(chars[:width]), tuple(probability_costs(chars, width))) for chars in poss_chars)
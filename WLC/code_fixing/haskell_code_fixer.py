@@ -2,21 +2,31 @@ import logging
 
 import collections
 
-from ..code_fixing.code_fixer import CodeFixer
+from ..code_fixing.code_fixer import CodeFixer, FIX_LINE_TIME_BUDGET, FIX_TIME_BUDGET
+from ..code_fixing.fix_state import FixState, usable_state
 
 LOGGER = logging.getLogger()
 
 
 class HaskellCodeFixer(CodeFixer):
-    def __init__(self, code, indents, poss_lines):
+    def __init__(self, code, indents, poss_lines, time_budget=FIX_TIME_BUDGET, line_time_budget=FIX_LINE_TIME_BUDGET,
+                 previous_state=None):
         self.code = code
         self.indents = indents
         self.poss_lines = poss_lines
 
+        self.time_budget = time_budget
+        self.line_time_budget = line_time_budget
+        self.truncated_lines = set()
+
+        self.previous_state = usable_state(previous_state, type(self))
+        self.fix_state = FixState(type(self))
+
         self.syntax = []
         self.rules = []
         self.statements = []
 
+        self.closest_matches = []
         self.context = {'variables': [], 'functions': []}
 
         self.func_context = collections.defaultdict(lambda: collections.defaultdict(list))
@@ -30,6 +40,14 @@ class HaskellCodeFixer(CodeFixer):
         self.syntax.append(('ARGS', '.*?'))
         self.syntax.append(('VAL', '.+'))
 
+        LOGGER.debug('Loading compiled haskell rules.')
+        self.rules_regexes, self.statements_regexes = self.compiled_rules()
+
+    def define_rules(self):
+        """
+        Defines the main and statement rules. Only called for the first fixer of the process, the compiled rules are
+        shared by all of the fixers created after it.
+        """
         self.statements.append(('(STATEMENT) && (STATEMENT)', 4, None, self.fix_and))
         self.statements.append(('(STATEMENT) || (STATEMENT)', 4, None, self.fix_or))
         self.statements.append(('not (STATEMENT)', 4, None, self.fix_not))
@@ -42,12 +60,6 @@ class HaskellCodeFixer(CodeFixer):
         self.rules.append(("(FUNCTION) (ARGS)", 1, self.analyse_func, self.fix_func_decl_newline))
         self.rules.append(('(.*)', 0, None, self.fix_default))  # If nothing else works this will
 
-        LOGGER.debug('Compiling main haskell rules.')
-        self.rules_regexes = self.compile_regex(self.rules)
-
-        LOGGER.debug('Compiling haskell statement rules.')
-        self.statements_regexes = self.compile_regex(self.statements)
-
     def fix(self):
         """
         Main function to be called which finds the closest regex match for each line, extracts context variables and
@@ -58,28 +70,41 @@ class HaskellCodeFixer(CodeFixer):
         LOGGER.debug('Starting haskell code fixing.')
 
         fixed_lines = []
-        closest_matches = []
+        self.resume_budget()
 
         LOGGER.debug('Looking for closest matches.')
-        for i in range(len(self.poss_lines)):  # range loop OK because of indexing type
-            closest_match = self.find_closest_match(self.poss_lines[i], self.rules_regexes)
-            (match, analyze_func, _) = closest_match
-
-            if analyze_func:
-                analyze_func(match.groups(), i)
-
-            closest_matches.append(closest_match)
+        # Lines which were added with add_line have already been analyzed.
+        for i in range(len(self.closest_matches), len(self.poss_lines)):  # range loop OK because of indexing type
+            self.analyze_line(i)
 
         LOGGER.debug('Fixing lines.')
-        for idx, closest_match in enumerate(closest_matches):
+        for idx, closest_match in enumerate(self.closest_matches):
             (match, _, fix_func) = closest_match
+            self.start_line(idx)
 
-            fixed = fix_func(match, self.poss_lines[idx])
+            fixed = self.fix_line(idx, match, fix_func)
             fixed_lines.append(fixed)
 
+        if self.truncated_lines:
+            LOGGER.info("Ran out of time fixing lines %s.", sorted(self.truncated_lines))
+
         return "\n".join("{indent}{code}".format(indent="  " * indent, code=line) for indent, line in
                          zip(self.indents, fixed_lines))
 
+    def analyze_line(self, line_n):
+        """
+        Finds the closest regex match for the line and extracts context variables and function names from it. Lines
+        have to be analyzed in order.
+        """
+        self.start_line(line_n)
+        closest_match = self.find_line_match(line_n)
+        (match, analyze_func, _) = closest_match
+
+        if analyze_func:
+            analyze_func(match.groups(), line_n)
+
+        self.closest_matches.append(closest_match)
+
     def analyse_global_assignment(self, groups, line_n):
         var_name = groups[1]
         self.context['functions'].append(var_name)
@@ -0,0 +1,90 @@
+from functools import lru_cache
+
+
+class KeywordTrie:
+    """
+    Trie of the literal prefixes of the rules, mostly keywords such as 'import' or 'def'. Walking it against the first
+    possible characters of a line gives a lower bound of the errors of every rule, so the rules which cannot match the
+    line within their allowed errors are skipped without running them. Rules without a prefix are always tried.
+    """
+
+    def __init__(self, patterns):
+        self.size = len(patterns)
+        self.generic = []
+        self.root = _Node()
+        self.depth = max((len(pattern.prefix) for pattern in patterns), default=0)
+
+        for idx, pattern in enumerate(patterns):
+            if not pattern.prefix:
+                self.generic.append(idx)
+                continue
+
+            node = self.root
+            node.budget = max(node.budget, pattern.max_errors)
+
+            for char in pattern.prefix:
+                node = node.children.setdefault(char, _Node())
+                node.budget = max(node.budget, pattern.max_errors)
+
+            node.rules.append((idx, pattern.max_errors))
+
+    def candidates(self, lattice):
+        """
+        :param lattice: Lattice of the line
+        :return: Indexes of the rules which could match the line, in their original order
+        """
+        return [idx for idx, _ in self.bounds(lattice)]
+
+    def bounds(self, lattice):
+        """
+        :param lattice: Lattice of the line
+        :return: List of (index, lowest number of errors the rule can match the line with) of the rules which could
+                 match the line, in their original order
+        """
+        if not self.root.children:
+            return [(idx, 0) for idx in range(self.size)]
+
+        found = [(idx, 0) for idx in self.generic]
+        # row[j] is the lowest number of errors needed to align the prefix of the node with the first j positions,
+        # positions further than the longest prefix and the most allowed errors cannot give a lower bound.
+        positions = min(lattice.length, self.depth + self.root.budget)
+        self._walk(self.root, list(range(positions + 1)), lattice, found)
+
+        return sorted(found)
+
+    def _walk(self, node, row, lattice, found):
+        lowest = min(row)
+
+        for idx, max_errors in node.rules:
+            if lowest <= max_errors:
+                found.append((idx, lowest))
+
+        for char, child in node.children.items():
+            if lowest > child.budget:
+                continue
+
+            child_row = [row[0] + 1]
+
+            for j in range(1, len(row)):
+                substitution = row[j - 1] + (char not in lattice.alternatives[j - 1])
+                child_row.append(min(substitution, row[j] + 1, child_row[j - 1] + 1))
+
+            self._walk(child, child_row, lattice, found)
+
+
+class _Node:
+    __slots__ = ('children', 'rules', 'budget')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+        self.budget = 0
+
+
+@lru_cache(maxsize=None)
+def keyword_trie(patterns):
+    """
+    :param patterns: Tuple of the compiled rules, they are shared by the fixers so the trie is only built once
+    :return: KeywordTrie of the rules
+    """
+    return KeywordTrie(patterns)
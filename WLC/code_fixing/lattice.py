@@ -0,0 +1,624 @@
+from functools import lru_cache
+
+import numpy as np
+import regex
+
+from ..code_fixing.permutations import character_costs
+
+# Cost of one error in the matcher. The lower bits hold how much less probable the characters of the alignment are
+# than the most probable ones, so among the alignments with the fewest errors the one of the most probable permutation
+# wins, which is the permutation the fixer used to try first. The total of the probability costs of a line has to stay
+# below the cost of an error.
+ERROR_COST = 2 ** 32
+
+# Probability cost of a character per unit of its negative log probability compared to the most probable one.
+PROBABILITY_COST = 2 ** 10
+
+# Cost used for states of the matcher that cannot be reached.
+UNREACHABLE = 2 ** 56
+
+OPEN, CLOSE, ATOM, LOOP = range(4)
+
+# Kind of the steps before the first token of the shorter alternatives of a CombinedPattern.
+PADDING = -1
+
+# Code of the characters which are not ASCII in the character tables of a CombinedPattern, the code after it stands for
+# missing alternatives.
+OTHER_CODE = 128
+
+
+class Lattice:
+    """
+    Possible characters of a line or part of a line, only the first width alternatives of every position are used. The
+    lattice describes every permutation of the line at once so rules can be matched without generating them.
+    """
+
+    def __init__(self, poss_chars, width):
+        self.alternatives = [chars[:width] for chars in poss_chars]
+        self.length = len(self.alternatives)
+        self.complete = all(self.alternatives)
+        self.ambiguous = any(len(chars) > 1 for chars in self.alternatives)
+        self.string = ''.join(chars[0] for chars in self.alternatives) if self.complete else None
+
+        # Probability cost of every alternative, 0 for the most probable one of its position.
+        self.probability_costs = [probability_costs(chars, width) for chars in poss_chars]
+
+        self._costs = {}
+
+    def costs(self, allowed):
+        """
+        :param allowed: Characters accepted by a rule atom or None if it accepts any character
+        :return: Array with the cost of aligning the atom with every position, the probability cost of the most probable
+                 allowed alternative or ERROR_COST if none of the alternatives is allowed
+        """
+        if allowed not in self._costs:
+            self._costs[allowed] = np.array([self._cost(allowed, position) for position in range(self.length)],
+                                            dtype=np.int64)
+
+        return self._costs[allowed]
+
+    def pick(self, allowed, position):
+        """
+        :return: The most probable alternative at the position which is allowed by the atom, the most probable one if
+                 none of them is allowed
+        """
+        chars = self.alternatives[position]
+        ranked = sorted(zip(self.probability_costs[position], range(len(chars)), chars))
+
+        for _, _, char in ranked:
+            if allowed is None or char in allowed:
+                return char
+
+        return ranked[0][2]
+
+    def _cost(self, allowed, position):
+        allowed_costs = [cost for char, cost in zip(self.alternatives[position], self.probability_costs[position])
+                         if allowed is None or char in allowed]
+
+        return min(allowed_costs) if allowed_costs else ERROR_COST
+
+
+class LatticeMatch:
+    """
+    Result of matching a rule against a lattice, has the parts of the regex match interface used by the fixers.
+    """
+
+    def __init__(self, string, spans, fuzzy_counts):
+        self.string = string
+        self.fuzzy_counts = fuzzy_counts
+        self._spans = spans
+
+    def group(self, n=0):
+        start, end = self.span(n)
+        return self.string[start:end] if start >= 0 else None
+
+    def groups(self):
+        return tuple(self.group(n) for n in range(1, len(self._spans)))
+
+    def span(self, n=0):
+        return self._spans[n]
+
+    def start(self, n=0):
+        return self._spans[n][0]
+
+    def end(self, n=0):
+        return self._spans[n][1]
+
+    def __repr__(self):
+        return '<LatticeMatch string={!r} fuzzy_counts={}>'.format(self.string, self.fuzzy_counts)
+
+
+def probability_costs(chars, width):
+    """
+    :param chars: Possible characters of one position. Type: [Char] or PossibleChars
+    :param width: Number of the most probable characters to use
+    :return: Probability cost of each of the first width characters in their order, 0 for the most probable one
+    """
+    costs = character_costs(chars, width)
+    return [round((cost - min(costs, default=0)) * PROBABILITY_COST) for cost in costs]
+
+
+def freeze_match(match):
+    """
+    Copies a regex match into a LatticeMatch, which unlike regex matches can be pickled and sent to other processes.
+    """
+    if isinstance(match, LatticeMatch):
+        return match
+
+    spans = [match.span(n) for n in range(len(match.groups()) + 1)]
+    return LatticeMatch(match.string, spans, tuple(match.fuzzy_counts))
+
+
+class LatticePattern:
+    """
+    Fuzzy rule which can be matched against a lattice of possible characters. The best alignment of the rule and the
+    lattice is found with dynamic programming over the positions of the line so the cost is linear in its length
+    instead of exponential like matching every permutation. Insertions, deletions and substitutions cost one error each
+    just like the fuzzy matching of the regex module. Ties between alignments with the same errors go to the most
+    probable permutation, the one the fixer used to match first.
+
+    Only the subset of the regex syntax used by the rules is supported: literals, escapes, '.', character sets, the '*'
+    and '+' quantifiers (greedy or lazy), groups and top level alternation. The regex is compiled either way so rules
+    using anything else are still matched by the caller, one permutation at a time.
+    """
+
+    def __init__(self, rule, max_errors):
+        self.max_errors = max_errors
+        self.regex = regex.compile('^(?e)((?:%s){e<=%s})$' % (rule, max_errors))
+        self.pattern = self.regex.pattern
+        # Sort key of the rule among the rules of the same fixer, set from the rule stats.
+        self.priority = (0, 0)
+
+        try:
+            self.alternatives, self.group_count = _parse(rule)
+        except ValueError:
+            self.alternatives, self.group_count = None, 0
+
+    @property
+    def supports_lattice(self):
+        return self.alternatives is not None
+
+    @property
+    def prefix(self):
+        """
+        Literal text every match of the rule has to start with, ignoring the errors. Empty if the rule does not start
+        with a literal or has several alternatives.
+        """
+        if not self.alternatives or len(self.alternatives) > 1:
+            return ''
+
+        prefix = []
+
+        for token in self.alternatives[0]:
+            if token[0] == ATOM and token[1] is not None and len(token[1]) == 1:
+                prefix.extend(token[1])
+            elif token[0] not in (OPEN, CLOSE):
+                break
+
+        return ''.join(prefix)
+
+    def match(self, lattice, timeout=None):
+        """
+        Matches the rule against every permutation of the lattice at once. If the lattice has only one permutation the
+        regex is matched against it directly.
+
+        :param lattice: Lattice of the line or a single permutation as a string
+        :param timeout: Seconds the regex may take, fuzzy matching can backtrack for a very long time on some lines.
+                        None for no limit
+        :raise TimeoutError: If the regex did not finish in time
+        :return: The best match with at most max_errors errors or None
+        """
+        if isinstance(lattice, str):
+            return self.regex.match(lattice, timeout=timeout)
+
+        if not lattice.complete:
+            return None
+
+        if not lattice.ambiguous:
+            return self.regex.match(lattice.string, timeout=timeout)
+
+        best = None
+
+        for tokens in self.alternatives:
+            costs = self._costs(tokens, lattice)
+            cost = costs[0][0][0]
+
+            if cost // ERROR_COST <= self.max_errors and (best is None or cost < best[0]):
+                best = cost, tokens, costs
+
+        if best is None:
+            return None
+
+        _, tokens, costs = best
+        return self._reconstruct(tokens, costs, lattice)
+
+    def _costs(self, tokens, lattice):
+        """
+        Computes for every token and position the lowest cost needed to match the rest of the rule against the rest of
+        the lattice, the number of errors times ERROR_COST plus the probability costs of the characters.
+
+        :return: List of (cost starting with an insertion, cost starting with the token) arrays of every token
+        """
+        n = lattice.length
+        positions = np.arange(n + 1) * ERROR_COST
+
+        end = np.full(n + 1, UNREACHABLE, dtype=np.int64)
+        end[n] = 0
+        costs = [None] * len(tokens) + [(_insert(end, positions), end)]
+
+        for i in range(len(tokens) - 1, -1, -1):
+            kind = tokens[i][0]
+            after = costs[i + 1][0]
+
+            if kind in (OPEN, CLOSE):
+                here = after
+            elif kind == ATOM:
+                here = after + ERROR_COST
+                here[:n] = np.minimum(here[:n], after[1:] + lattice.costs(tokens[i][1]))
+            else:
+                _, allowed, minimum, _ = tokens[i]
+                consumed = _consumed(lattice.costs(allowed))
+                here = after + minimum * ERROR_COST
+                here[:n] = np.minimum(here[:n], _suffix_min(consumed + after)[1:] - consumed[:n])
+
+            costs[i] = (_insert(here, positions), here)
+
+        return costs
+
+    def _reconstruct(self, tokens, costs, lattice):
+        """
+        Follows the lowest cost alignment from the start of the line, preferring the choices the regex module would try
+        first. Every position gets the most probable alternative allowed by the atom it is aligned to.
+        """
+        chars = [lattice.pick(None, position) for position in range(lattice.length)]
+        spans = [(-1, -1)] * (self.group_count + 1)
+        spans[0] = spans[1] = (0, lattice.length)
+        substitutions = insertions = deletions = 0
+        starts = {}
+        position = 0
+
+        for i, token in enumerate(tokens + [None]):
+            with_insertions, here = costs[i]
+            target = with_insertions[position]
+
+            offsets = np.arange(lattice.length + 1 - position) * ERROR_COST
+            skipped = int(np.flatnonzero(here[position:] + offsets == target)[0])
+            insertions += skipped
+            position += skipped
+            target = here[position]
+
+            if token is None:
+                break
+
+            kind = token[0]
+            after = costs[i + 1][0]
+
+            if kind == OPEN:
+                starts[token[1]] = position
+            elif kind == CLOSE:
+                spans[token[1]] = (starts[token[1]], position)
+            elif kind == ATOM:
+                allowed = token[1]
+                atom_costs = lattice.costs(allowed)
+
+                if position < lattice.length and after[position + 1] + atom_costs[position] == target:
+                    chars[position] = lattice.pick(allowed, position)
+                    substitutions += int(atom_costs[position] // ERROR_COST)
+                    position += 1
+                else:
+                    deletions += 1
+            else:
+                _, allowed, minimum, lazy = token
+                consumed = _consumed(lattice.costs(allowed))
+                ends = np.flatnonzero(consumed[position + 1:] - consumed[position] + after[position + 1:] == target)
+                ends = ends + position + 1
+                skip = after[position] + minimum * ERROR_COST == target
+
+                if not len(ends) or (skip and lazy and not minimum):
+                    deletions += minimum
+                else:
+                    end = int(ends[0] if lazy else ends[-1])
+
+                    for j in range(position, end):
+                        chars[j] = lattice.pick(allowed, j)
+
+                    substitutions += int((consumed[end] - consumed[position]) // ERROR_COST)
+                    position = end
+
+        return LatticeMatch(''.join(chars), spans, (substitutions, insertions, deletions))
+
+
+class CombinedPattern:
+    """
+    Rule set compiled into one matcher. The token lists of the alternatives of all of the rules are aligned at their
+    ends and tagged with the rule they belong to, then the dynamic programming of LatticePattern runs on all of them
+    at once: every step handles one token of every alternative, so the line is scanned once per token position instead
+    of once per token of every rule. Only the match of the best rule is reconstructed.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        # (index of the rule, tokens) of every alternative of the rules which can be matched against a lattice
+        self.rows = [(idx, tokens) for idx, pattern in enumerate(patterns) if pattern.supports_lattice
+                     for tokens in pattern.alternatives]
+
+        steps = [[token for token in tokens if token[0] in (ATOM, LOOP)] for _, tokens in self.rows]
+        self.length = max((len(tokens) for tokens in steps), default=0)
+
+        # Distinct character sets of the atoms, None stands for '.' and for the padding.
+        self.allowed = [None]
+        allowed_index = {None: 0}
+
+        self.kinds = np.full((len(self.rows), self.length), PADDING, dtype=np.int64)
+        self.minimums = np.zeros((len(self.rows), self.length), dtype=np.int64)
+        self.allowed_indexes = np.zeros((len(self.rows), self.length), dtype=np.int64)
+
+        for row, tokens in enumerate(steps):
+            offset = self.length - len(tokens)
+
+            for j, token in enumerate(tokens):
+                if token[1] not in allowed_index:
+                    allowed_index[token[1]] = len(self.allowed)
+                    self.allowed.append(token[1])
+
+                self.kinds[row, offset + j] = token[0]
+                self.allowed_indexes[row, offset + j] = allowed_index[token[1]]
+                self.minimums[row, offset + j] = token[2] if token[0] == LOOP else 0
+
+        self.rows_of = {}
+
+        for row, (idx, _) in enumerate(self.rows):
+            self.rows_of.setdefault(idx, []).append(row)
+
+        # accepts[a, code] tells whether the character set a accepts the ASCII character with the code. Other
+        # characters have the code OTHER_CODE and are only accepted by '.', sets with other characters are matched
+        # with Lattice.costs instead.
+        self.accepts = np.zeros((len(self.allowed), OTHER_CODE + 2), dtype=bool)
+        self.unicode_sets = []
+
+        for a, allowed in enumerate(self.allowed):
+            if allowed is None:
+                self.accepts[a, :OTHER_CODE + 1] = True
+            elif all(ord(char) < OTHER_CODE for char in allowed):
+                self.accepts[a, [ord(char) for char in allowed]] = True
+            else:
+                self.unicode_sets.append(a)
+
+    def match(self, lattice, candidates, offsets):
+        """
+        Finds the rule whose errors minus its offset are the lowest, ties go to the rule listed first in candidates.
+        Only matches within the allowed errors of a rule count, like with LatticePattern.match. Of the alternatives of
+        the rule the one with the lowest cost wins, like with LatticePattern.match.
+
+        :param lattice: Lattice of the line, it has to be complete
+        :param candidates: Indexes of the rules to try in order of preference, they have to support lattices
+        :param offsets: Offset of every rule
+        :return: Index of the best rule and its match, (None, None) if no rule matches
+        """
+        rows = [row for idx in candidates for row in self.rows_of.get(idx, ())]
+
+        if not rows:
+            return None, None
+
+        first = int(np.argmax((self.kinds[rows] != PADDING).any(axis=0))) if self.length else 0
+        costs = self._costs(lattice, rows, first)
+        starts = costs[0][0][:, 0]
+        best = None
+
+        for local, row in enumerate(rows):
+            idx = self.rows[row][0]
+            cost = int(starts[local])
+            errors = cost // ERROR_COST
+
+            if errors > self.patterns[idx].max_errors:
+                continue
+
+            if best is None or errors - offsets[idx] < best[0] or (idx == self.rows[best[1]][0] and cost < best[3]):
+                best = errors - offsets[idx], row, local, cost
+
+        if best is None:
+            return None, None
+
+        _, row, local, _ = best
+        return self.rows[row][0], self._reconstruct(lattice, row, local, costs)
+
+    def _costs(self, lattice, rows, first):
+        """
+        Same as LatticePattern._costs for the rows at once, steps before first are only padding.
+
+        :return: List of (cost starting with an insertion, cost starting with the token) matrices of every step and the
+                 end of the rules, with one row for every alternative
+        """
+        n = lattice.length
+        positions = np.arange(n + 1) * ERROR_COST
+
+        kinds = self.kinds[rows]
+        is_atom = (kinds == ATOM)[:, :, None]
+        is_loop = (kinds == LOOP)[:, :, None]
+        loop_steps = is_loop.any(axis=0)[:, 0]
+        minimums = self.minimums[rows][:, :, None]
+
+        atom_costs = self._atom_costs(lattice)[self.allowed_indexes[rows]]
+        consumed = np.concatenate((np.zeros(atom_costs.shape[:2] + (1,), dtype=np.int64),
+                                   np.cumsum(atom_costs, axis=2)), axis=2)
+
+        end = np.full((len(rows), n + 1), UNREACHABLE, dtype=np.int64)
+        end[:, n] = 0
+        costs = [(_insert(end, positions), end)]
+
+        for step in range(self.length - 1, first - 1, -1):
+            after = costs[0][0]
+
+            atom = after + ERROR_COST
+            atom[:, :n] = np.minimum(atom[:, :n], after[:, 1:] + atom_costs[:, step])
+            here = np.where(is_atom[:, step], atom, after)
+
+            if loop_steps[step]:
+                step_consumed = consumed[:, step]
+                loop = after + minimums[:, step] * ERROR_COST
+                loop[:, :n] = np.minimum(loop[:, :n], _suffix_min(step_consumed + after)[:, 1:] - step_consumed[:, :n])
+                here = np.where(is_loop[:, step], loop, here)
+
+            costs.insert(0, (_insert(here, positions), here))
+
+        return costs
+
+    def _atom_costs(self, lattice):
+        """
+        :return: Matrix with the costs of aligning every character set of the rules with the positions of the lattice,
+                 the same as Lattice.costs
+        """
+        width = max(len(chars) for chars in lattice.alternatives)
+        codes = np.array([[_code(char) for char in chars] + [OTHER_CODE + 1] * (width - len(chars))
+                          for chars in lattice.alternatives], dtype=np.int64)
+        probability_costs = np.array([costs + [ERROR_COST] * (width - len(costs))
+                                      for costs in lattice.probability_costs], dtype=np.int64)
+
+        atom_costs = np.where(self.accepts[:, codes], probability_costs, ERROR_COST).min(axis=2)
+
+        for a in self.unicode_sets:
+            atom_costs[a] = lattice.costs(self.allowed[a])
+
+        # The reconstruction of the best match looks them up again.
+        for a, allowed in enumerate(self.allowed):
+            lattice._costs.setdefault(allowed, atom_costs[a])
+
+        return atom_costs
+
+    def _reconstruct(self, lattice, row, local, costs):
+        """
+        Picks the costs of the alternative for each of its tokens, groups get the costs of the token after them, and
+        reconstructs the match with the LatticePattern of the rule.
+
+        :param row: Index of the alternative in self.rows
+        :param local: Index of the alternative in the cost matrices
+        """
+        idx, tokens = self.rows[row]
+        step = len(costs) - 1
+        token_costs = [(costs[step][0][local], costs[step][1][local])]
+
+        for token in reversed(tokens):
+            if token[0] in (ATOM, LOOP):
+                step -= 1
+                token_costs.insert(0, (costs[step][0][local], costs[step][1][local]))
+            else:
+                token_costs.insert(0, (token_costs[0][0], token_costs[0][0]))
+
+        return self.patterns[idx]._reconstruct(tokens, token_costs, lattice)
+
+
+def _code(char):
+    return ord(char) if len(char) == 1 and ord(char) < OTHER_CODE else OTHER_CODE
+
+
+@lru_cache(maxsize=None)
+def combined_pattern(patterns):
+    """
+    :param patterns: Tuple of the compiled rules, they are shared by the fixers so they are only combined once
+    :return: CombinedPattern of the rules
+    """
+    return CombinedPattern(patterns)
+
+
+def _insert(costs, positions):
+    """
+    Lets any number of extra characters of the line be skipped before a token, each costing one insertion.
+    """
+    return _suffix_min(costs + positions) - positions
+
+
+def _suffix_min(values):
+    return np.minimum.accumulate(values[..., ::-1], axis=-1)[..., ::-1]
+
+
+def _consumed(costs):
+    """
+    :return: Sum of the costs before every position, consuming positions i to j costs consumed[j] - consumed[i]
+    """
+    return np.concatenate(([0], np.cumsum(costs)))
+
+
+def _parse(rule):
+    """
+    Parses a rule into lists of tokens, one list for every top level alternative.
+
+    :param rule: Rule with the syntax expressions already expanded
+    :return: Token lists and the number of the last group, the rule itself is wrapped in group 1
+    :raises ValueError: When the rule uses syntax which is not supported
+    """
+    alternatives = [[]]
+    groups = []
+    group_count = 1
+    i = 0
+
+    while i < len(rule):
+        char = rule[i]
+
+        if rule.startswith('(?:', i):
+            groups.append(None)
+            i += 3
+            continue
+        elif rule.startswith('(?', i):
+            raise ValueError("Unsupported group in {}.".format(rule))
+        elif char == '(':
+            group_count += 1
+            groups.append(group_count)
+            alternatives[-1].append((OPEN, group_count))
+            i += 1
+            continue
+        elif char == ')':
+            if not groups:
+                raise ValueError("Unbalanced parenthesis in {}.".format(rule))
+
+            group = groups.pop()
+
+            if group is not None:
+                alternatives[-1].append((CLOSE, group))
+
+            i += 1
+
+            if i < len(rule) and rule[i] in '*+?{':
+                raise ValueError("Quantified groups are not supported in {}.".format(rule))
+            continue
+        elif char == '|':
+            if groups:
+                raise ValueError("Only top level alternation is supported in {}.".format(rule))
+
+            alternatives.append([])
+            i += 1
+            continue
+        elif char == '\\':
+            if i + 1 >= len(rule) or rule[i + 1].isalnum():
+                raise ValueError("Unsupported escape in {}.".format(rule))
+
+            allowed = frozenset(rule[i + 1])
+            i += 2
+        elif char == '[':
+            end = rule.find(']', i + 2)
+
+            if end < 0:
+                raise ValueError("Unterminated character set in {}.".format(rule))
+
+            allowed = _parse_set(rule[i + 1:end])
+            i = end + 1
+        elif char == '.':
+            allowed = None
+            i += 1
+        elif char in '*+?{}^$':
+            raise ValueError("Unsupported {} in {}.".format(char, rule))
+        else:
+            allowed = frozenset(char)
+            i += 1
+
+        if i < len(rule) and rule[i] in '*+':
+            minimum = 0 if rule[i] == '*' else 1
+            lazy = rule.startswith('?', i + 1)
+            alternatives[-1].append((LOOP, allowed, minimum, lazy))
+            i += 2 if lazy else 1
+        elif i < len(rule) and rule[i] in '?{':
+            raise ValueError("Unsupported quantifier in {}.".format(rule))
+        else:
+            alternatives[-1].append((ATOM, allowed))
+
+    if groups:
+        raise ValueError("Unbalanced parenthesis in {}.".format(rule))
+
+    return alternatives, group_count
+
+
+def _parse_set(characters):
+    if characters.startswith('^') or '\\' in characters or '[' in characters:
+        raise ValueError("Unsupported character set [{}].".format(characters))
+
+    allowed = set()
+    i = 0
+
+    while i < len(characters):
+        if i + 2 < len(characters) and characters[i + 1] == '-':
+            allowed.update(chr(code) for code in range(ord(characters[i]), ord(characters[i + 2]) + 1))
+            i += 3
+        else:
+            allowed.add(characters[i])
+            i += 1
+
+    return frozenset(allowed)
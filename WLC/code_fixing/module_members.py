@@ -0,0 +1,105 @@
+import gzip
+import json
+import logging
+import subprocess
+import sys
+from os.path import dirname, join, isfile
+
+from stdlib_list import stdlib_list
+
+LOGGER = logging.getLogger()
+
+# Bump when the format of the index changes, older indexes are then ignored until they are exported again.
+MEMBERS_VERSION = 1
+STDLIB_VERSION = "3.6"
+MEMBERS_PATH = join(dirname(__file__), 'stdlib_members.json.gz')
+
+# Packages which open windows, start programs or print when imported.
+SKIPPED_PACKAGES = ('antigravity', 'idlelib', 'this', 'turtledemo')
+IMPORT_TIMEOUT = 30
+
+# Run by a separate python process for every module, prints the public members of the module as json.
+MEMBERS_SCRIPT = """
+import importlib, json, sys
+module = importlib.import_module(sys.argv[1])
+members = getattr(module, '__all__', None)
+if members is None:
+    members = [member for member in dir(module) if not member.startswith('_')]
+print(json.dumps(list(dict.fromkeys(str(member) for member in members))))
+"""
+
+
+def export_module_members(path=MEMBERS_PATH, python=sys.executable):
+    """
+    Imports every module of the standard library list and saves its public members, either __all__ or the names in
+    dir() which do not start with an underscore. Every module is imported by a separate python process so modules which
+    hang, exit or change the interpreter cannot break the export. This takes a few minutes and is only meant to be run
+    offline, the fixer only ever reads the saved index.
+
+    :param path: Path where the gzipped json index should be saved
+    :param python: Interpreter the modules are imported with, it should be the version the fixer runs on
+    """
+    modules = {}
+    version = subprocess.run([python, '-c', 'import sys; print(sys.version.split()[0])'],
+                             stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip()
+
+    for name in stdlib_list(STDLIB_VERSION):
+        if name.split('.')[0] in SKIPPED_PACKAGES or name.endswith('__main__'):
+            continue
+
+        try:
+            result = subprocess.run([python, '-W', 'ignore', '-c', MEMBERS_SCRIPT, name],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    timeout=IMPORT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            LOGGER.debug("Skipping %s, importing it timed out.", name)
+            continue
+
+        if result.returncode != 0:
+            LOGGER.debug("Skipping %s, it could not be imported.", name)
+            continue
+
+        try:
+            modules[name] = json.loads(result.stdout.decode('utf-8').splitlines()[-1])
+        except (IndexError, ValueError):
+            LOGGER.debug("Skipping %s, importing it did not print its members.", name)
+
+    LOGGER.info("Saving the members of %d modules to %s.", len(modules), path)
+
+    with gzip.open(path, 'wt', encoding='utf-8') as index_file:
+        json.dump({'version': MEMBERS_VERSION, 'stdlib': STDLIB_VERSION, 'python': version, 'modules': modules},
+                  index_file, sort_keys=True)
+
+
+def load_module_members(path=MEMBERS_PATH):
+    """
+    :param path: Path of the index saved by export_module_members
+    :return: Dictionary of module name to the list of its public members, empty if there is no usable index. An index
+             generated with another python version than the running one is not used either, its members could be
+             wrong.
+    """
+    if not isfile(path):
+        LOGGER.warning("No module member index at %s, method names on imports will not be fixed.", path)
+        return {}
+
+    with gzip.open(path, 'rt', encoding='utf-8') as index_file:
+        index = json.load(index_file)
+
+    if index.get('version') != MEMBERS_VERSION or index.get('stdlib') != STDLIB_VERSION:
+        LOGGER.warning("Module member index at %s is outdated (version %s for %s), it should be exported again.",
+                       path, index.get('version'), index.get('stdlib'))
+        return {}
+
+    if index.get('python', '').split('.')[:2] != [str(part) for part in sys.version_info[:2]]:
+        LOGGER.warning("Module member index at %s was generated with python %s, method names on imports will not be "
+                       "fixed. Export it again with this python.", path, index.get('python'))
+        return {}
+
+    LOGGER.debug("Loaded the members of %d modules generated with python %s.", len(index['modules']), index['python'])
+    return index['modules']
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    export_module_members(sys.argv[1] if len(sys.argv) > 1 else MEMBERS_PATH,
+                          sys.argv[2] if len(sys.argv) > 2 else sys.executable)
@@ -0,0 +1,75 @@
+import heapq
+from math import log
+
+# Probability ratio between an alternative and the one before it when the OCR did not provide probabilities.
+DEFAULT_PROBABILITY_RATIO = 0.5
+
+# Probabilities are clipped to this so that the logarithm is defined.
+MINIMUM_PROBABILITY = 1e-12
+
+
+def most_probable_permutations(poss_chars, width, limit):
+    """
+    Generates the permutations of a line in descending joint probability, the probability of a permutation being the
+    product of the probabilities of its characters. Permutations are taken from a heap: every permutation has a single
+    parent which is at least as probable, the permutation with the last changed position changed back, so every one is
+    generated exactly once and only after its parent.
+
+    :param poss_chars: Possible characters that make up the line. Type: [[Char]] or [PossibleChars]
+    :param width: Number of the most probable characters of every position to use
+    :param limit: Maximum number of permutations to generate
+    :return: Generator of the permutations as strings
+    """
+    if not all(poss_chars):
+        return
+
+    line = [chars[0] for chars in poss_chars]
+    # (position in the line, characters, cost of each character compared to the most probable one)
+    positions = []
+
+    for idx, chars in enumerate(poss_chars):
+        if len(chars) > 1:
+            ranked = _ranked(chars, width)
+            positions.append((idx, [char for _, char in ranked], [cost - ranked[0][0] for cost, _ in ranked]))
+
+    heap = [(0.0, (0,) * len(positions), 0)]
+    generated = 0
+
+    while heap and generated < limit:
+        cost, indexes, last = heapq.heappop(heap)
+
+        for (idx, chars, _), rank in zip(positions, indexes):
+            line[idx] = chars[rank]
+
+        yield ''.join(line)
+        generated += 1
+
+        for j in range(last, len(positions)):
+            _, chars, costs = positions[j]
+            rank = indexes[j]
+
+            if rank + 1 < len(chars):
+                child = indexes[:j] + (rank + 1,) + indexes[j + 1:]
+                heapq.heappush(heap, (cost + costs[rank + 1] - costs[rank], child, j))
+
+
+def character_costs(chars, width):
+    """
+    :param chars: Possible characters of one position. Type: [Char] or PossibleChars
+    :param width: Number of the most probable characters to use
+    :return: Negative log probability of each of the first width characters, in their order
+    """
+    probabilities = getattr(chars, 'probabilities', None)
+
+    if probabilities is None:
+        probabilities = [DEFAULT_PROBABILITY_RATIO ** rank for rank in range(len(chars))]
+
+    return [-log(max(probability, MINIMUM_PROBABILITY)) for probability in probabilities[:min(width, len(chars))]]
+
+
+def _ranked(chars, width):
+    """
+    :return: List of (negative log probability, character) of the first width characters, most probable first
+    """
+    ranked = sorted((cost, rank, char) for rank, (char, cost) in enumerate(zip(chars, character_costs(chars, width))))
+    return [(cost, char) for cost, _, char in ranked]
@@ -1,34 +1,103 @@
 import collections
-import importlib
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os import environ
+
+from ..code_fixing.code_fixer import CodeFixer, FIX_LINE_TIME_BUDGET, FIX_TIME_BUDGET
+from ..code_fixing.fix_state import FixState, usable_state
+from ..code_fixing.lattice import freeze_match
+from ..code_fixing.static import standard_module_member_vocabulary, standard_python_function_vocabulary, \
+    standard_python_modules
+from ..code_fixing.vocabulary import Vocabulary
 
-from stdlib_list import stdlib_list
+LOGGER = logging.getLogger()
 
-from ..code_fixing.code_fixer import CodeFixer
-from ..code_fixing.static import standard_python_functions
+# Number of processes the fix pass runs on, 0 or 1 fixes the lines in the calling thread.
+FIX_PROCESSES = int(environ.get('FIX_PROCESSES', 0))
 
-LOGGER = logging.getLogger()
+# Programs with fewer lines are fixed in the calling thread, sending them to other processes would be slower.
+MINIMUM_PARALLEL_LINES = 8
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def process_pool(processes):
+    """
+    :return: Process pool with the number of processes, created the first time it is needed and then reused
+    """
+    with _process_pools_lock:
+        if processes not in _process_pools:
+            LOGGER.info("Starting %d fixer processes.", processes)
+            _process_pools[processes] = ProcessPoolExecutor(processes)
+
+        return _process_pools[processes]
+
+
+def _fix_in_process(fixer_class, states, tasks, deadline, line_time_budget):
+    """
+    Fixes lines in a worker process. The fixer is restored from the frozen contexts of the parent fixer, its compiled
+    rules are shared by every task the process runs.
+
+    :param fixer_class: Class of the fixer which analyzed the lines
+    :param states: Dictionary of the contexts of the fixer from context_state needed by the tasks
+    :param tasks: List of (line number, context, rule index, match, possible characters, current def, current class)
+    :param deadline: Monotonic time at which the budget of the parent fixer runs out or None
+    :param line_time_budget: Seconds the fix of one line may take, 0 for no limit
+    :return: List of (line number, fixed line, whether the fix ran out of time)
+    """
+    fixer = fixer_class('', [], {})
+    fixer.deadline, fixer.line_time_budget = deadline, line_time_budget
+    restored = None
+    fixed = []
+
+    for line_n, state, rule, match, poss_chars, curr_def, curr_class in tasks:
+        if state != restored:
+            fixer.restore_context_state(states[state])
+            restored = state
+
+        fixer.curr_line_n, fixer.curr_def, fixer.curr_class = line_n, curr_def, curr_class
+        fixer.start_line(line_n)
+        fix_func = fixer.rules_regexes[rule][3]
+        fixed.append((line_n, fix_func(match, poss_chars), line_n in fixer.truncated_lines))
+
+    return fixed
 
 
 class PythonCodeFixer(CodeFixer):
-    def __init__(self, code, indents, poss_lines):
+    CONTEXT_FIXES = ('fix_import', 'fix_import_as', 'fix_from_import')
+
+    def __init__(self, code, indents, poss_lines, processes=FIX_PROCESSES, time_budget=FIX_TIME_BUDGET,
+                 line_time_budget=FIX_LINE_TIME_BUDGET, previous_state=None):
         self.code = code
         self.indents = indents
         self.poss_lines = poss_lines
+        self.processes = processes
+
+        self.time_budget = time_budget
+        self.line_time_budget = line_time_budget
+        self.truncated_lines = set()
+
+        self.previous_state = usable_state(previous_state, type(self))
+        self.fix_state = FixState(type(self))
 
         self.syntax = []
         self.rules = []
         self.statements = []
 
         self.curr_line_n = 0
-        self.context = {'variables': [], 'functions': standard_python_functions(), 'classes': [], 'imports': [], 'methods': []}
+        self.closest_matches = []
+        self.context = {'variables': Vocabulary(), 'functions': standard_python_function_vocabulary().copy(),
+                        'classes': Vocabulary(), 'imports': Vocabulary(), 'methods': Vocabulary()}
 
         self.class_indent = 0
-        self.class_context = collections.defaultdict(lambda: collections.defaultdict(list))
+        self.class_context = collections.defaultdict(lambda: collections.defaultdict(Vocabulary))
         self.curr_class = None
 
         self.def_indent = 0
-        self.def_context = collections.defaultdict(lambda: collections.defaultdict(list))
+        self.def_context = collections.defaultdict(lambda: collections.defaultdict(Vocabulary))
         self.curr_def = None
 
         self.syntax.append(('VARIABLE', '[a-z_]+'))
@@ -37,6 +106,14 @@ class PythonCodeFixer(CodeFixer):
         self.syntax.append(('STATEMENT', '.+'))
         self.syntax.append(('PARAMETERS', '.*'))
 
+        LOGGER.debug('Loading compiled rules.')
+        self.rules_regexes, self.statements_regexes = self.compiled_rules()
+
+    def define_rules(self):
+        """
+        Defines the main and statement rules. Only called for the first fixer of the process, the compiled rules are
+        shared by all of the fixers created after it.
+        """
         self.statements.append(('(FUNCTION)\((PARAMETERS)\)', 2, None, self.fix_func_or_class_call))
         self.statements.append(('lambda (PARAMETERS): (STATEMENT)', 9, None, self.fix_lambda))
         self.statements.append(('(VARIABLE)\.(FUNCTION)\((PARAMETERS)\)', 3, None, self.fix_method_call))
@@ -90,12 +167,6 @@ class PythonCodeFixer(CodeFixer):
         self.rules.append(('continue', 8, None, lambda x, y: 'continue'))
         self.rules.append(('(.*)', 0, None, self.fix_default))  # If nothing else works this will
 
-        LOGGER.debug('Compiling main rules.')
-        self.rules_regexes = self.compile_regex(self.rules)
-
-        LOGGER.debug('Compiling statement rules.')
-        self.statements_regexes = self.compile_regex(self.statements)
-
     def fix(self):
         """
         Main function to be called which finds the closest regex match for each line, extracts context variables and
@@ -106,47 +177,161 @@ class PythonCodeFixer(CodeFixer):
         LOGGER.debug('Starting python3 code fixing.')
 
         fixed_lines = []
-        closest_matches = []
-
-        LOGGER.debug('Looking for closest matches.')
-        for i in range(len(self.poss_lines)):  # range loop OK because of indexing type
-            closest_match = self.find_closest_match(self.poss_lines[i], self.rules_regexes)
-            (match, analyze_func, _) = closest_match
-
-            # At each line, check if currently in a class declaration.
-            if self.indents[i] < self.class_indent and self.curr_class:
-                self.curr_class = None
 
-            if self.indents[i] < self.def_indent and self.curr_def:
-                self.curr_def = None
+        self.resume_budget()
 
-            if analyze_func:
-                analyze_func(match.groups(), i)
-
-            closest_matches.append(closest_match)
+        LOGGER.debug('Looking for closest matches.')
+        # Lines which were added with add_line have already been analyzed.
+        for i in range(len(self.closest_matches), len(self.poss_lines)):  # range loop OK because of indexing type
+            self.analyze_line(i)
 
         self.curr_def = None
         self.curr_class = None
 
-        LOGGER.debug('Fixing lines.')
-        for idx, closest_match in enumerate(closest_matches):
-            (match, _, fix_func) = closest_match
+        if self.processes > 1 and len(self.closest_matches) >= MINIMUM_PARALLEL_LINES:
+            LOGGER.debug("Fixing lines on {} processes.".format(self.processes))
+            fixed_lines = [self.naive_fix(fixed) for fixed in self.fix_lines_in_processes(self.processes)]
+        else:
+            LOGGER.debug('Fixing lines.')
+            for idx, closest_match in enumerate(self.closest_matches):
+                (match, _, fix_func) = closest_match
 
-            # At each line, check if currently in a class declaration.
-            if self.indents[idx] < self.class_indent and self.curr_class:
-                self.curr_class = None
+                # At each line, check if currently in a class declaration.
+                self.update_scope(idx)
+                self.curr_line_n = idx
+                self.start_line(idx)
 
-            if self.indents[idx] < self.def_indent and self.curr_def:
-                self.curr_def = None
+                fixed = self.fix_line(idx, match, fix_func)
+                fixed_lines.append(self.naive_fix(fixed))
 
-            self.curr_line_n = idx
+        LOGGER.debug("Fix cache: %s", self.fix_cache.stats())
 
-            fixed = fix_func(match, self.poss_lines[idx])
-            fixed_lines.append(self.naive_fix(fixed))
+        if self.truncated_lines:
+            LOGGER.info("Ran out of time fixing lines %s.", sorted(self.truncated_lines))
 
         return "\n".join("{indent}{code}".format(indent="  " * indent, code=line) for indent, line in
                          zip(self.indents, fixed_lines))
 
+    def fix_lines_in_processes(self, processes):
+        """
+        Runs the fix functions of the analyzed lines on a process pool. Lines whose fix adds to the context are fixed
+        here in order first, every other line is sent to a worker with a frozen copy of the context as it is at that
+        line, so the lines are fixed exactly as if they were fixed one after the other. Fixes reused from the previous
+        state are not sent.
+
+        :param processes: Number of processes to use
+        :return: List of the fixed lines
+        """
+        fixed = {}
+        keys = {}
+        states = []
+        tasks = []
+        changed = True
+
+        for line_n, (match, _, fix_func) in enumerate(self.closest_matches):
+            self.update_scope(line_n)
+            self.curr_line_n = line_n
+
+            if fix_func is None:
+                fixed[line_n] = self.unfixed_line(line_n)
+                continue
+
+            if getattr(fix_func, '__name__', None) in self.CONTEXT_FIXES:
+                self.start_line(line_n)
+                fixed[line_n] = fix_func(match, self.poss_lines[line_n])
+                changed = True
+                continue
+
+            keys[line_n] = self.fix_key(line_n)
+
+            if self.previous_state is not None and keys[line_n] in self.previous_state.fixed:
+                fixed[line_n] = self.previous_state.fixed[keys[line_n]]
+                self.keep_fix(line_n, keys[line_n], fixed[line_n])
+                continue
+
+            if changed:
+                states.append(self.context_state())
+                changed = False
+
+            tasks.append((line_n, len(states) - 1, self.rule_index(fix_func), freeze_match(match),
+                          self.poss_lines[line_n], self.curr_def, self.curr_class))
+
+        pool = process_pool(processes)
+        size = max(ceil(len(tasks) / processes), 1)
+        futures = []
+
+        for idx in range(0, len(tasks), size):
+            part = tasks[idx:idx + size]
+            part_states = {state: states[state] for state in set(task[1] for task in part)}
+            futures.append(pool.submit(_fix_in_process, type(self), part_states, part, self.deadline,
+                                       self.line_time_budget))
+
+        for future in futures:
+            for line_n, fixed_line, truncated in future.result():
+                fixed[line_n] = fixed_line
+
+                if truncated:
+                    self.truncated_lines.add(line_n)
+
+                self.keep_fix(line_n, keys[line_n], fixed_line)
+
+        return [fixed[line_n] for line_n in range(len(self.closest_matches))]
+
+    def update_scope(self, line_n):
+        """
+        Leaves the scopes which the line is not indented in anymore.
+        """
+        if self.indents[line_n] < self.class_indent and self.curr_class:
+            self.curr_class = None
+
+        if self.indents[line_n] < self.def_indent and self.curr_def:
+            self.curr_def = None
+
+    def context_state(self):
+        """
+        :return: Picklable copy of the context which does not change when the context of the fixer changes
+        """
+        return {'context': {key: vocabulary.copy() for key, vocabulary in self.context.items()},
+                'class_context': {name: {key: vocabulary.copy() for key, vocabulary in scope.items()}
+                                  for name, scope in self.class_context.items()},
+                'def_context': {name: {key: vocabulary.copy() for key, vocabulary in scope.items()}
+                                for name, scope in self.def_context.items()},
+                'class_indent': self.class_indent, 'def_indent': self.def_indent}
+
+    def restore_context_state(self, state):
+        """
+        Replaces the context of the fixer by a copy returned by context_state.
+        """
+        self.context = state['context']
+        self.class_indent = state['class_indent']
+        self.def_indent = state['def_indent']
+
+        self.class_context = collections.defaultdict(lambda: collections.defaultdict(Vocabulary))
+        self.def_context = collections.defaultdict(lambda: collections.defaultdict(Vocabulary))
+
+        for name, scope in state['class_context'].items():
+            self.class_context[name].update(scope)
+
+        for name, scope in state['def_context'].items():
+            self.def_context[name].update(scope)
+
+    def analyze_line(self, line_n):
+        """
+        Finds the closest regex match for the line and extracts context variables and function names from it. Lines
+        have to be analyzed in order.
+        """
+        self.start_line(line_n)
+        closest_match = self.find_line_match(line_n)
+        (match, analyze_func, _) = closest_match
+
+        # At each line, check if currently in a class declaration.
+        self.update_scope(line_n)
+
+        if analyze_func:
+            analyze_func(match.groups(), line_n)
+
+        self.closest_matches.append(closest_match)
+
     def naive_fix(self, line):
         replace = [('--', '__'), ('\'\'', '"'), (',,', '"')]
 
@@ -248,7 +433,7 @@ class PythonCodeFixer(CodeFixer):
     def fix_import(self, match, poss_chars):
         groups = match.groups()
         poss_import = poss_chars[match.start(2): match.end(2)]
-        closest, _ = self.levenshtein_closest(poss_import, stdlib_list("3.6"))
+        closest, _ = self.levenshtein_closest(poss_import, standard_python_modules())
         LOGGER.debug("Fixing import. Changing from {} to {}, and adding to context after analysis.".format(groups[1],
                                                                                                            closest))
 
@@ -258,7 +443,7 @@ class PythonCodeFixer(CodeFixer):
     def fix_import_as(self, match, poss_chars):
         groups = match.groups()
         poss_import = poss_chars[match.start(2): match.end(2)]
-        closest_module, _ = self.levenshtein_closest(poss_import, stdlib_list("3.6"))
+        closest_module, _ = self.levenshtein_closest(poss_import, standard_python_modules())
         LOGGER.debug("Fixing import as. Changing from {} to {}, and adding {} "
                      "to context after analysis.".format(groups[1], closest_module, groups[2]))
 
@@ -268,7 +453,7 @@ class PythonCodeFixer(CodeFixer):
     def fix_from_import(self, match, poss_chars):
         groups = match.groups()
         poss_import = poss_chars[match.start(2): match.end(2)]
-        closest_module, _ = self.levenshtein_closest(poss_import, stdlib_list("3.6"))
+        closest_module, _ = self.levenshtein_closest(poss_import, standard_python_modules())
         imported = [i.strip() for i in groups[2].split(",")]
         LOGGER.debug("Fixing from X import Y. Changing from {} to {}, and adding {}"
                      " to context after analysis.".format(groups[1], closest_module, imported))
@@ -407,18 +592,16 @@ class PythonCodeFixer(CodeFixer):
             closest_method, _ = self.levenshtein_closest(poss_method, self.context["methods"])
             LOGGER.debug("Fixing method call method. From {} to {}".format(groups[2], closest_method))
         else:
-            # is an import -> method can be checked if __all__ is present
-            # TODO: workaround __all__ not being present
+            # is an import -> method can be checked against the public members of the module if it is known
             closest_callable = closest_import
             LOGGER.debug("Method call was found to be on an import!")
             LOGGER.debug("Fixing method call var. From {} to {}".format(groups[1], closest_import))
 
-            imported = importlib.import_module(closest_import)
-            if hasattr(imported, "__all__"):
-                closest_method, _ = self.levenshtein_closest(poss_method, imported.__all__)
+            members = standard_module_member_vocabulary(closest_import)
+            if members is not None:
+                closest_method, _ = self.levenshtein_closest(poss_method, members)
             else:
                 closest_method = groups[2]
-            del imported
 
             LOGGER.debug("Fixing method call method. From {} to {}".format(groups[2], closest_method))
 
@@ -491,6 +674,9 @@ class PythonCodeFixer(CodeFixer):
         return 'def {}({}):'.format(*groups[1:])
 
     def fix_arguments(self, args, poss_chars):
+        return self.memoized('arguments', poss_chars, args, lambda: self._fix_arguments(args, poss_chars))
+
+    def _fix_arguments(self, args, poss_chars):
         arg_matches = self.find_args(args)
 
         LOGGER.debug("Fixing {} arguments: {}".format(len(arg_matches), arg_matches))
@@ -503,6 +689,10 @@ class PythonCodeFixer(CodeFixer):
         return ", ".join(result)
 
     def fix_statement(self, match, poss_chars):
+        return self.memoized('statement', poss_chars, match.groups()[0],
+                             lambda: self._fix_statement(match, poss_chars))
+
+    def _fix_statement(self, match, poss_chars):
         matched, analyze_func, fix_func = self.find_closest_match(poss_chars, self.statements_regexes)
 
         if fix_func:
@@ -515,6 +705,9 @@ class PythonCodeFixer(CodeFixer):
 
     # TODO: ensure we don't fix non-vars
     def fix_variable(self, match, poss_chars):
+        return self.memoized('variable', poss_chars, None, lambda: self._fix_variable(match, poss_chars))
+
+    def _fix_variable(self, match, poss_chars):
         if self.curr_def:
             ctxt = self.def_context[self.curr_def]['variables'] + self.context['variables']
         elif self.curr_class:
@@ -525,6 +718,22 @@ class PythonCodeFixer(CodeFixer):
         LOGGER.debug("Fixing variable {} to {}.".format(match.groups()[0], closest))
         return closest
 
+    def context_snapshot(self):
+        """
+        Fingerprints of the global context and of the scopes of the current def and class, which are all the
+        statement fixes can read.
+        """
+        snapshot = [vocabulary.fingerprint for vocabulary in self.context.values()]
+
+        if self.curr_def:
+            snapshot.append(self.def_context[self.curr_def]['variables'].fingerprint)
+
+        if self.curr_class:
+            snapshot.append(self.class_context[self.curr_class]['variables'].fingerprint)
+            snapshot.append(self.class_context[self.curr_class]['methods'].fingerprint)
+
+        return self.curr_def, self.curr_class, tuple(snapshot)
+
     def fix_range_generator(self, match, poss_chars):
         groups = match.groups()
 
@@ -0,0 +1,123 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+LOGGER = logging.getLogger()
+
+RULE_STATS_VERSION = 1
+
+# How many lines are matched between two saves of the stats file.
+SAVE_INTERVAL = 1000
+
+
+class RuleStats:
+    """
+    How often every rule of the fixers was tried, how long matching it took and how often it was the closest match.
+    The stats are kept in a json file so that the rules can be tried in the order they win in on real boards from the
+    start. Several processes can share the file, each one adds what it has counted since its last save.
+    """
+
+    def __init__(self, path=None, record=None):
+        """
+        :param path: Path of the stats file or None to keep the stats in memory only
+        :param record: Whether the fixers should record their matches, by default only if there is a stats file
+        """
+        self.path = path
+        self.record = bool(path) if record is None else record
+
+        self.tries = Counter()
+        self.seconds = Counter()
+        self.wins = Counter()
+
+        self._unsaved = (Counter(), Counter(), Counter())
+        self._matched = 0
+        self._lock = threading.Lock()
+
+        if path:
+            self._add(self._load())
+            atexit.register(self.save)
+
+    def tried(self, language, rule, seconds):
+        with self._lock:
+            for counter, value in zip((self.tries, self.seconds), (1, seconds)):
+                counter[language, rule] += value
+
+            for counter, value in zip(self._unsaved[:2], (1, seconds)):
+                counter[language, rule] += value
+
+    def won(self, language, rule):
+        with self._lock:
+            self.wins[language, rule] += 1
+            self._unsaved[2][language, rule] += 1
+            self._matched += 1
+            save = self.path and self._matched % SAVE_INTERVAL == 0
+
+        if save:
+            self.save()
+
+    def priority(self, language, rule):
+        """
+        :return: Sort key of the rule, rules which win most of the times they are tried come first and rules which are
+                 cheaper to match come before rules which win as often
+        """
+        tries = self.tries[language, rule]
+
+        if not tries:
+            return 0, 0
+
+        return -self.wins[language, rule] / tries, self.seconds[language, rule] / tries
+
+    def save(self):
+        """
+        Adds the counts since the last save to the stats file.
+        """
+        if not self.path:
+            return
+
+        with self._lock:
+            unsaved = self._unsaved
+            self._unsaved = (Counter(), Counter(), Counter())
+
+        stats = self._load()
+
+        for counter, name in zip(unsaved, ('tries', 'seconds', 'wins')):
+            for (language, rule), value in counter.items():
+                rule_stats = stats.setdefault(language, {}).setdefault(rule, {'tries': 0, 'seconds': 0, 'wins': 0})
+                rule_stats[name] += value
+
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+
+        try:
+            with open(temporary, 'w') as file:
+                json.dump({'version': RULE_STATS_VERSION, 'languages': stats}, file)
+
+            os.replace(temporary, self.path)
+        except OSError:
+            LOGGER.exception("Could not save the rule stats to %s.", self.path)
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                stats = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            LOGGER.exception("Could not load the rule stats from %s.", self.path)
+            return {}
+
+        if stats.get('version') != RULE_STATS_VERSION:
+            LOGGER.warning("Ignoring the rule stats in %s, they have version %s instead of %s.", self.path,
+                           stats.get('version'), RULE_STATS_VERSION)
+            return {}
+
+        return stats['languages']
+
+    def _add(self, stats):
+        for language, rules in stats.items():
+            for rule, rule_stats in rules.items():
+                self.tries[language, rule] += rule_stats['tries']
+                self.seconds[language, rule] += rule_stats['seconds']
+                self.wins[language, rule] += rule_stats['wins']
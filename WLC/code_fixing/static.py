@@ -1,3 +1,11 @@
+from functools import lru_cache
+
+from stdlib_list import stdlib_list
+
+from ..code_fixing.module_members import load_module_members
+from ..code_fixing.vocabulary import Vocabulary
+
+
 def standard_python_functions():
     return ['abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray', 'bytes', 'callable', 'chr', 'classmethod',
             'compile', 'complex', 'copyright', 'credits', 'delattr', 'dict', 'dir', 'divmod', 'enumerate', 'eval',
@@ -6,3 +14,38 @@ def standard_python_functions():
             'max', 'memoryview', 'min', 'next', 'object', 'oct', 'open', 'ord', 'pow', 'print', 'property', 'quit',
             'range', 'repr', 'reversed', 'round', 'set', 'setattr', 'slice', 'sorted', 'staticmethod', 'str', 'sum',
             'super', 'tuple', 'type', 'vars', 'zip']
+
+
+@lru_cache(maxsize=None)
+def standard_python_function_vocabulary():
+    """
+    Searchable vocabulary of the built in functions, fixers start from a copy of it. Built once per process.
+    """
+    return Vocabulary(standard_python_functions())
+
+
+@lru_cache(maxsize=None)
+def standard_python_modules():
+    """
+    Searchable vocabulary of the standard library modules. Built once per process.
+    """
+    return Vocabulary(stdlib_list("3.6"))
+
+
+@lru_cache(maxsize=None)
+def standard_module_members():
+    """
+    Public members of the standard library modules from the prebuilt index. Loaded once per process, when it is first
+    needed.
+    """
+    return load_module_members()
+
+
+@lru_cache(maxsize=256)
+def standard_module_member_vocabulary(module):
+    """
+    :param module: Name of a standard library module
+    :return: Searchable vocabulary of the public members of the module or None if it is not in the index
+    """
+    members = standard_module_members().get(module)
+    return Vocabulary(members) if members is not None else None
@@ -0,0 +1,151 @@
+from itertools import chain
+
+import editdistance
+
+
+class Vocabulary(list):
+    """
+    List of words which also keeps a BK-tree of them so the words within an edit distance of a string can be found
+    without comparing the string to all of them. The tree is updated as words are appended or extended, other ways of
+    changing the list are not tracked and should not be used.
+    """
+
+    def __init__(self, words=()):
+        super().__init__()
+        self._root = None
+        self._hash = hash(())
+        self.extend(words)
+
+    @property
+    def fingerprint(self):
+        """
+        Summary of the words which changes whenever a word is added, cheap enough to be part of cache keys.
+        """
+        return len(self), self._hash
+
+    def append(self, word):
+        super().append(word)
+        self._hash = hash((self._hash, word))
+        self._insert(word, len(self) - 1)
+
+    def extend(self, words):
+        for word in words:
+            self.append(word)
+
+    def __iadd__(self, words):
+        self.extend(words)
+        return self
+
+    def __add__(self, other):
+        return ChainedVocabulary(self, other)
+
+    def __reduce__(self):
+        return _restore_vocabulary, (list(self), self._root, self._hash)
+
+    def copy(self):
+        """
+        Copies the words and the tree without computing any distances, used to start from a static vocabulary.
+        """
+        copied = Vocabulary()
+        list.extend(copied, self)
+        copied._root = _copy_node(self._root)
+        copied._hash = self._hash
+        return copied
+
+    def search(self, word, radius=None):
+        """
+        Finds the words within the edit distance radius of the word.
+
+        :param word: String to compare the words to
+        :param radius: Maximum edit distance, None to get all of the words
+        :return: List of (position, word, distance) in the order the words were added. Repeated words are only
+                 returned for the position they were first added at.
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        nodes = [self._root]
+
+        while nodes:
+            node_word, position, children = nodes.pop()
+            distance = editdistance.eval(word, node_word)
+
+            if radius is None or distance <= radius:
+                found.append((position, node_word, distance))
+
+            for child_distance, child in children.items():
+                if radius is None or distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+
+        return sorted(found)
+
+    def _insert(self, word, position):
+        if self._root is None:
+            self._root = (word, position, {})
+            return
+
+        node = self._root
+
+        while True:
+            node_word, _, children = node
+            distance = editdistance.eval(word, node_word)
+
+            if distance == 0:
+                return
+
+            if distance not in children:
+                children[distance] = (word, position, {})
+                return
+
+            node = children[distance]
+
+
+class ChainedVocabulary:
+    """
+    Several vocabularies searched one after the other as if they were one, without building a new tree.
+    """
+
+    def __init__(self, *vocabularies):
+        self.vocabularies = vocabularies
+
+    def __iter__(self):
+        return chain(*self.vocabularies)
+
+    def __len__(self):
+        return sum(len(vocabulary) for vocabulary in self.vocabularies)
+
+    def __add__(self, other):
+        return ChainedVocabulary(*self.vocabularies, other)
+
+    def search(self, word, radius=None):
+        found = []
+
+        for idx, vocabulary in enumerate(self.vocabularies):
+            found.extend(((idx, position), found_word, distance)
+                         for position, found_word, distance in as_vocabulary(vocabulary).search(word, radius))
+
+        return found
+
+
+def as_vocabulary(words):
+    """
+    :return: The words themselves if they can already be searched, otherwise a new Vocabulary of them
+    """
+    return words if hasattr(words, 'search') else Vocabulary(words)
+
+
+def _restore_vocabulary(words, root, words_hash):
+    vocabulary = Vocabulary()
+    list.extend(vocabulary, words)
+    vocabulary._root = root
+    vocabulary._hash = words_hash
+    return vocabulary
+
+
+def _copy_node(node):
+    if node is None:
+        return None
+
+    word, position, children = node
+    return word, position, {distance: _copy_node(child) for distance, child in children.items()}
@@ -1,6 +1,9 @@
 import logging
+import os
+from os.path import isdir, isfile, join
 
 import cv2
+import numpy as np
 from image_segmentation.extended_image import Preferences
 from image_segmentation.picture import Picture
 
@@ -8,6 +11,39 @@ from ..utils.path import get_full_path
 
 LOGGER = logging.getLogger()
 
+# Grayscale difference above which a pixel counts as changed between two frames.
+CHANGE_THRESHOLD = 40
+
+# Number of changed pixels a region needs to count as changed, so that camera noise is ignored.
+MINIMUM_CHANGED_PIXELS = 25
+
+
+def changed_pixels(previous, frame):
+    """
+    Finds the pixels which changed between two frames of the same board.
+
+    :return: Boolean mask of the changed pixels or None if the frames cannot be compared
+    """
+    if previous is None or previous.shape != frame.shape:
+        return None
+
+    return cv2.absdiff(_to_gray(previous), _to_gray(frame)) > CHANGE_THRESHOLD
+
+
+def region_changed(changed, x, y, width, height):
+    """
+    Returns whether the region changed according to the mask returned by changed_pixels, everything counts as changed
+    if there is no mask.
+    """
+    if changed is None:
+        return True
+
+    return np.count_nonzero(changed[y:y + height, x:x + width]) >= MINIMUM_CHANGED_PIXELS
+
+
+def _to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
 
 class Camera:
     _camera_id = None
@@ -47,6 +83,59 @@ class Camera:
         height, width, _ = img.shape
         return Picture(img, 0, 0, width, height, to_show)
 
+    def read_frames(self, source):
+        """
+        Reads the frames of a video file, or the images of a directory (in file name order) or of a list of files.
+        """
+        if isinstance(source, str) and isdir(get_full_path(source)):
+            directory = get_full_path(source)
+            source = [join(directory, f) for f in sorted(os.listdir(directory))
+                      if isfile(join(directory, f)) and not f.startswith(".")]
+
+        if isinstance(source, str):
+            cap = cv2.VideoCapture(get_full_path(source))
+
+            if not cap.isOpened():
+                raise Exception("File does not exist!")
+
+            ret, frame = cap.read()
+            while ret:
+                yield frame
+                ret, frame = cap.read()
+
+            cap.release()
+        else:
+            for file_name in source:
+                frame = cv2.imread(get_full_path(file_name))
+
+                if frame is None:
+                    raise Exception("File does not exist!")
+
+                yield frame
+
+    def capture_continuous(self, source, show_pic=False, show_line=False, show_word=False, show_character=False,
+                           annotate=False):
+        """
+        Continuous mode for a live whiteboard session, yields a picture for every frame of the source in which the
+        board changed since the last yielded frame. Frames without changes are skipped.
+
+        :param source: Video file, directory of frames or list of frame files
+        """
+        LOGGER.debug("Capturing frames from %s", source)
+        to_show = Preferences(show_pic, show_line, show_word, show_character, annotate)
+        previous = None
+
+        for frame_n, frame in enumerate(self.read_frames(source)):
+            changed = changed_pixels(previous, frame)
+
+            if changed is not None and np.count_nonzero(changed) < MINIMUM_CHANGED_PIXELS:
+                LOGGER.debug("Skipping frame %d, the board did not change.", frame_n)
+                continue
+
+            previous = frame
+            height, width, _ = frame.shape
+            yield Picture(frame, 0, 0, width, height, to_show)
+
     def capture(self, show_pic=False, show_line=False, show_word=False, show_character=False, image_path="",
                 annotate=False):
         LOGGER.debug("Capturing image")
@@ -0,0 +1,136 @@
+import json
+import logging
+
+import h5py
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+LOGGER = logging.getLogger()
+
+ACTIVATIONS = ('relu', 'softmax')
+
+
+def export_numpy_model(h5_path, npz_path):
+    """
+    Exports the layers and weights of the keras model into a compact npz file which can be run by NumpyModel without
+    importing tensorflow or keras. Only the layers used by the character classifier are supported.
+
+    :param h5_path: Path of the full keras save of the model
+    :param npz_path: Path where the exported model should be saved
+    """
+    LOGGER.info("Exporting %s to %s.", h5_path, npz_path)
+
+    with h5py.File(h5_path, 'r') as h5_file:
+        config = h5_file.attrs['model_config']
+        config = json.loads(config.decode('utf-8') if isinstance(config, bytes) else config)
+        weights = h5_file['model_weights']
+
+        layers = []
+        arrays = {}
+
+        for layer in config['config']:
+            kind = layer['class_name']
+            layer_config = layer['config']
+            name = layer_config['name']
+
+            if kind in ('Conv2D', 'Dense'):
+                if kind == 'Conv2D' and (layer_config['padding'], tuple(layer_config['strides'])) != ('valid', (1, 1)):
+                    raise ValueError("Only valid convolutions with a stride of 1 are supported ({}).".format(name))
+
+                arrays['kernel_{}'.format(len(layers))] = weights[name][name]['kernel:0'][()]
+                arrays['bias_{}'.format(len(layers))] = weights[name][name]['bias:0'][()]
+                layers.append(kind.lower())
+
+                if layer_config['activation'] != 'linear':
+                    layers.append(_activation(layer_config))
+
+            elif kind == 'Activation':
+                layers.append(_activation(layer_config))
+
+            elif kind == 'MaxPooling2D':
+                if tuple(layer_config['pool_size']) != (2, 2) or tuple(layer_config['strides']) != (2, 2):
+                    raise ValueError("Only 2x2 max pooling is supported ({}).".format(name))
+
+                layers.append('maxpooling2d')
+
+            elif kind == 'Flatten':
+                layers.append('flatten')
+
+            elif kind != 'Dropout':  # Dropout does nothing at inference time
+                raise ValueError("Layer {} of type {} is not supported.".format(name, kind))
+
+    np.savez_compressed(npz_path, layers=np.array(layers), **arrays)
+
+
+def _activation(layer_config):
+    activation = layer_config['activation']
+
+    if activation not in ACTIVATIONS:
+        raise ValueError("Activation {} is not supported ({}).".format(activation, layer_config['name']))
+
+    return activation
+
+
+class NumpyModel:
+    """
+    Runs the forward pass of the exported character classifier with numpy only. Has the same predict interface as the
+    keras model so it can be used in its place.
+    """
+
+    def __init__(self, npz_path):
+        with np.load(npz_path) as exported:
+            self.layers = [(layer, exported.get('kernel_{}'.format(idx)), exported.get('bias_{}'.format(idx)))
+                           for idx, layer in enumerate(exported['layers'].tolist())]
+
+    def predict(self, batch, batch_size=None):
+        batch_size = batch_size or len(batch)
+        return np.concatenate([self._forward(batch[idx:idx + batch_size]) for idx in range(0, len(batch), batch_size)])
+
+    def _forward(self, x):
+        for layer, kernel, bias in self.layers:
+            if layer == 'conv2d':
+                x = self._conv2d(x, kernel, bias)
+            elif layer == 'dense':
+                x = x.dot(kernel) + bias
+            elif layer == 'relu':
+                x = np.maximum(x, 0)
+            elif layer == 'softmax':
+                x = self._softmax(x)
+            elif layer == 'maxpooling2d':
+                x = self._max_pooling2d(x)
+            elif layer == 'flatten':
+                x = x.reshape(len(x), -1)
+
+        return x
+
+    def _conv2d(self, x, kernel, bias):
+        """
+        Valid convolution with a stride of 1 implemented as im2col followed by a single matrix multiplication.
+
+        :param x: Input of shape (N, H, W, C)
+        :param kernel: Keras kernel of shape (KH, KW, C, F)
+        :param bias: Bias of shape (F)
+        :return: Output of shape (N, H - KH + 1, W - KW + 1, F)
+        """
+        n, height, width, channels = x.shape
+        kernel_height, kernel_width, _, filters = kernel.shape
+        out_height, out_width = height - kernel_height + 1, width - kernel_width + 1
+
+        x = np.ascontiguousarray(x)
+        s_n, s_h, s_w, s_c = x.strides
+        windows = as_strided(x, shape=(n, out_height, out_width, kernel_height, kernel_width, channels),
+                             strides=(s_n, s_h, s_w, s_h, s_w, s_c), writeable=False)
+
+        columns = windows.reshape(n * out_height * out_width, kernel_height * kernel_width * channels)
+        out = columns.dot(kernel.reshape(-1, filters)) + bias
+
+        return out.reshape(n, out_height, out_width, filters)
+
+    def _max_pooling2d(self, x):
+        n, height, width, channels = x.shape
+        x = x[:, :height - height % 2, :width - width % 2]
+        return x.reshape(n, height // 2, 2, width // 2, 2, channels).max(axis=(2, 4))
+
+    def _softmax(self, x):
+        exp = np.exp(x - x.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
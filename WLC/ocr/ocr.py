@@ -1,59 +1,182 @@
+import collections
+import logging
 import pickle
+import threading
+import time
 from os import environ
-from os.path import dirname, join
+from os.path import dirname, join, isfile
 
 import numpy as np
-from keras.models import model_from_yaml
 
+from ..ocr.numpy_model import NumpyModel, export_numpy_model
+from ..ocr.possible_chars import PossibleChars
+from ..ocr.prediction_cache import PredictionCache, DEFAULT_CACHE_SIZE
 from ..utils.singleton import Singleton
 
+LOGGER = logging.getLogger()
+
 # Mute tensorflow debugging information on console
 environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 MINIMUM_PROBABILITY = 0.025
+PREDICTION_BATCH_SIZE = 256
+
+# At most this many classes can have a probability above MINIMUM_PROBABILITY, so looking at the top k is exact.
+TOP_K = int(1 / MINIMUM_PROBABILITY)
+
+# 'keras' runs the model with tensorflow, 'numpy' runs the exported weights with numpy only.
+ENGINES = ('keras', 'numpy')
+DEFAULT_ENGINE = environ.get('OCR_ENGINE', 'keras')
+
+# Size of the prediction cache (0 disables it) and optional path of a database to share it between processes.
+CACHE_SIZE = int(environ.get('OCR_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+CACHE_PATH = environ.get('OCR_CACHE_PATH')
 
 
 class OCR(metaclass=Singleton):
-    def __init__(self):
+    def __init__(self, engine=None):
+        """
+        :param engine: Which engine runs the model, one of ENGINES. Defaults to the OCR_ENGINE environment variable
+        """
+        self.engine = self.normalize_arguments(engine)['engine']
+
+        if self.engine not in ENGINES:
+            raise ValueError("Unsupported OCR engine {}, use one of {}.".format(self.engine, ", ".join(ENGINES)))
+
+        self._model_lock = threading.Lock()
         self._load_model()
         self._load_mapping()
 
+        self.cache = PredictionCache(CACHE_SIZE, CACHE_PATH, namespace=self.engine)
+
+    @classmethod
+    def normalize_arguments(cls, engine=None):
+        """
+        Resolves the default engine so that OCR(), OCR('keras') and OCR(engine='keras') share one loaded model.
+
+        :return: Dictionary of the engine argument
+        """
+        return {'engine': (engine or DEFAULT_ENGINE).lower()}
+
     def _load_model(self):
-        yaml_path = join(dirname(__file__), 'model/model.yaml')
+        # model.h5 is a full keras save, it contains the architecture as well as the weights.
         h5_path = join(dirname(__file__), 'model/model.h5')
 
-        yaml_file = open(yaml_path, 'r')
-        loaded_model_yaml = yaml_file.read()
-        yaml_file.close()
+        if self.engine == 'numpy':
+            npz_path = join(dirname(__file__), 'model/model.npz')
 
-        model = model_from_yaml(loaded_model_yaml)
-        model.load_weights(h5_path)
+            if not isfile(npz_path):
+                export_numpy_model(h5_path, npz_path)
 
-        self.model = model
+            self.model = NumpyModel(npz_path)
+        else:
+            # Imported here so that tensorflow is only loaded when it is actually used.
+            from keras.models import load_model
+            self.model = load_model(h5_path, compile=False)
 
     def _load_mapping(self):
         mapping_path = join(dirname(__file__), 'model/mapping.p')
         self.mapping = pickle.load(open(mapping_path, 'rb'))
 
-    def predict(self, char):
-        char = char.reshape(1, 28, 28, 1)
-
-        char = char.astype('float32')
-
-        char /= 255
+        # Lookup tables from class index to character and to the index of its lowercase version.
+        self.characters = np.array([chr(self.mapping[idx]) for idx in range(len(self.mapping))])
+        self.lowercase_characters, self.lowercase_classes = np.unique(np.char.lower(self.characters),
+                                                                      return_inverse=True)
 
-        prediction = self.model.predict(char)
-        sorted_preds = np.argsort(prediction, axis=1)[0]
+    def warm_up(self):
+        """
+        Runs a prediction on an empty character so that the lazily built parts of the model are ready before the first
+        real request comes in.
+        """
+        self.predict(np.zeros((28, 28), dtype='uint8'))
 
-        res = [(chr(self.mapping[(int(elem))]), prediction[0][elem]) for elem in sorted_preds][::-1]
-        return res[0][0], self.reduce_line(res)
-
-    def reduce_line(self, possibilities):
-        lowered = map(lambda p: (p[0].lower(), p[1]), possibilities)
-        filtered = list(map(lambda c: c[0], filter(lambda c: c[1] > MINIMUM_PROBABILITY, lowered)))
-        return self.remove_duplicate_predictions(filtered)
-
-    def remove_duplicate_predictions(self, seq):
-        seen = set()
-        seen_add = seen.add
-        return [x for x in seq if not (x in seen or seen_add(x))]
+    def predict(self, char):
+        return self.predict_batch([char])[0]
+
+    def predict_batch(self, chars):
+        """
+        Predicts all of the characters with a single call to the model, which is a lot cheaper than predicting them
+        one by one because the per call overhead of keras dominates for tiny inputs.
+
+        :param chars: List of 28x28 character images
+        :return: List of (most probable character, PossibleChars) tuples in the same order as the input
+        """
+        keys = [self.cache.key(char) for char in chars]
+        predictions = [self.cache.get(key) for key in keys]
+
+        # Identical characters are only predicted once, all of their positions get the same prediction.
+        uncached = collections.OrderedDict()
+        for idx, (key, prediction) in enumerate(zip(keys, predictions)):
+            if prediction is None:
+                uncached.setdefault(key, []).append(idx)
+
+        if uncached:
+            new_predictions = self._predict_uncached([chars[indices[0]] for indices in uncached.values()])
+
+            for (key, indices), prediction in zip(uncached.items(), new_predictions):
+                self.cache.put(key, prediction)
+
+                for idx in indices:
+                    predictions[idx] = prediction[0], prediction[1].copy()
+
+        LOGGER.debug("OCR prediction cache: %s", self.cache.stats())
+        return predictions
+
+    def _predict_uncached(self, chars):
+        batch = np.stack([char.reshape(28, 28, 1) for char in chars])
+
+        batch = batch.astype('float32')
+
+        batch /= 255
+
+        if self.engine == 'keras':
+            # Keras models cannot be used by several threads at the same time.
+            with self._model_lock:
+                predictions = self.model.predict(batch, batch_size=PREDICTION_BATCH_SIZE)
+        else:
+            predictions = self.model.predict(batch, batch_size=PREDICTION_BATCH_SIZE)
+
+        return self.decode_predictions(predictions)
+
+    def decode_predictions(self, predictions):
+        """
+        Decodes a batch of class probabilities into the most probable character and the lowercase characters which
+        are more probable than MINIMUM_PROBABILITY, ordered by probability and without duplicates. Every lowercase
+        character keeps the probability of its most probable class.
+
+        :param predictions: Class probabilities of each character. Type: (N, classes) array
+        :return: List of (most probable character, PossibleChars) tuples
+        """
+        top_k = min(TOP_K, predictions.shape[1])
+
+        top = np.argpartition(-predictions, top_k - 1, axis=1)[:, :top_k]
+        top_probabilities = np.take_along_axis(predictions, top, axis=1)
+
+        order = np.argsort(-top_probabilities, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_probabilities = np.take_along_axis(top_probabilities, order, axis=1)
+
+        # A class is kept if it is probable enough and no more probable class has the same lowercase character.
+        lowered = self.lowercase_classes[top]
+        probable = top_probabilities > MINIMUM_PROBABILITY
+        seen_before = np.tril(lowered[:, :, None] == lowered[:, None, :], -1) & probable[:, None, :]
+        keep = probable & ~seen_before.any(axis=2)
+
+        best = self.characters[top[:, 0]].tolist()
+        return [(best[idx], PossibleChars(self.lowercase_characters[lowered[idx][keep[idx]]].tolist(),
+                                          top_probabilities[idx][keep[idx]].tolist()))
+                for idx in range(len(predictions))]
+
+
+def preload_model():
+    """
+    Loads the OCR model and warms it up, should be called when a worker starts so that no request hits a cold model.
+    """
+    start = time.perf_counter()
+    ocr = OCR()
+    loaded = time.perf_counter()
+    ocr.warm_up()
+    warmed_up = time.perf_counter()
+
+    LOGGER.info("OCR model loaded in %.2fs and warmed up in %.2fs.", loaded - start, warmed_up - loaded)
+    return ocr
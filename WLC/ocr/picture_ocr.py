@@ -1,43 +1,206 @@
 import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import sys
 
-import numpy as np
-
+from ..image_processing.camera import region_changed
 from ..ocr.ocr import OCR
 
+try:
+    import uwsgi
+except ImportError:  # Not running under uwsgi
+    uwsgi = None
+
 LOGGER = logging.getLogger()
 
 
+def _default_workers():
+    """
+    :return: The cores left to every process, uwsgi runs a process per worker and each of them recognizes pictures
+    """
+    processes = uwsgi.numproc if uwsgi else 1
+    return max((os.cpu_count() or 1) // max(processes, 1), 1)
+
+
+# Number of lines which are segmented and recognized concurrently.
+DEFAULT_WORKERS = int(os.environ.get('OCR_WORKERS', _default_workers()))
+# Minimum number of characters sent to the model at once while streaming, enough to amortize the overhead of a call to
+# the model while the first lines can already be consumed.
+STREAM_BATCH_CHARACTERS = int(os.environ.get('OCR_STREAM_BATCH_CHARACTERS', 128))
+
+_line_pools = {}
+_line_pools_lock = threading.Lock()
+
+
+def line_pool(workers):
+    """
+    :return: Thread pool with the number of workers, created the first time it is needed and then shared by every
+             picture of the process so concurrent requests don't each start their own threads
+    """
+    with _line_pools_lock:
+        if workers not in _line_pools:
+            _line_pools[workers] = ThreadPoolExecutor(max_workers=workers)
+
+        return _line_pools[workers]
+
+
 class PictureOCR:
-    def __init__(self, picture):
+    def __init__(self, picture, batched=True, workers=DEFAULT_WORKERS, previous_lines=None, changed=None):
+        """
+        :param picture: Picture with the code
+        :param batched: Whether characters should be sent to the model together instead of one by one
+        :param workers: Number of lines which are segmented and recognized concurrently
+        :param previous_lines: recognized_lines of a previous picture of the same board, lines whose region did not
+                               change since then are reused instead of being recognized again
+        :param changed: Mask of the pixels which changed since the previous picture, see camera.changed_pixels
+        """
         self.picture = picture
         self.ocr = OCR()
+        self.batched = batched
+        self.workers = workers
         self.indentation_threshold = None
 
-    def get_code(self):
-        lines = self.picture.get_segments()
-        self.indentation_threshold = self.picture.get_indentation_threshold()
-        return self._merge_code_lines(lines)
+        self.previous_lines = previous_lines
+        self.changed = changed
+        self.recognized_lines = {}
 
-    def _merge_code_lines(self, lines):
-        """
-        Should return a string with the code from all of the lines, this function will also have to figure out how far
-        each line is indented.
+    def get_code(self):
         """
-        indents = self._determine_indentation(lines)
+        Recognizes the whole picture, all of the characters which are not reused are sent to the model at once.
 
+        :return: (code, indents, poss_lines) where poss_lines maps every line number to its possible characters
+        """
         coded_lines = []
+        indents = []
         lines_variations = {}
-        for idx, (indent, line) in enumerate(zip(indents, lines)):
-            words = line.get_segments()
-            code_line, poss_words = self._merge_code_words(words)
 
-            lines_variations[idx] = poss_words
+        for idx, (indent, code_line, poss_line) in enumerate(self.stream_code(batch_characters=None)):
+            indents.append(indent)
+            lines_variations[idx] = poss_line
             coded_lines.append("{indent}{code}".format(indent="  " * indent, code=code_line))
 
         return "\n".join(coded_lines), indents, lines_variations
 
+    def stream_code(self, batch_characters=STREAM_BATCH_CHARACTERS):
+        """
+        Recognizes the picture line by line and yields (indent, line, poss_line) for every line as soon as it has been
+        recognized, in order. The lines are segmented concurrently by the line pool while the characters of the lines
+        which are already segmented are sent to the model in batches across lines, so the caller can start working on
+        the first lines while the rest are still being recognized. Lines of the previous picture whose region did not
+        change are reused, the recognized lines are kept in recognized_lines keyed by their region for the next one.
+
+        :param batch_characters: Minimum number of characters sent to the model at once, None to send all of them in a
+                                 single batch
+        """
+        lines = self.picture.get_segments()
+        self.indentation_threshold = self.picture.get_indentation_threshold()
+        indents = self._determine_indentation(lines)
+
+        regions = [self._get_line_region(line_n) for line_n in range(len(lines))]
+        recognized = self._reused_lines(regions)
+        missing = [line_n for line_n, words in enumerate(recognized) if words is None]
+        futures = dict(zip(missing, self._recognize_lines([lines[line_n] for line_n in missing], batch_characters)))
+
+        try:
+            for line_n, indent in enumerate(indents):
+                if recognized[line_n] is None:
+                    recognized[line_n] = futures[line_n].result()
+
+                code_line, poss_line = self._merge_code_words(recognized[line_n])
+                yield indent, code_line, poss_line
+        finally:
+            # Don't recognize the rest of the lines if the caller stopped early.
+            for future in futures.values():
+                future.cancel()
+
+        self.recognized_lines = dict(zip(regions, recognized))
+
+    def _segment_line(self, line):
+        """
+        Segments the line into words and the words into character images. Type: [[image]]
+        """
+        return [[char.get_segments() for char in word.get_segments()] for word in line.get_segments()]
+
+    def _recognize_line(self, line):
+        """
+        Segments the line and predicts its characters one by one, used when batching is off.
+        """
+        return [[self.ocr.predict(image) for image in word] for word in self._segment_line(line)]
+
+    def _reused_lines(self, regions):
+        """
+        :return: Recognized words of the lines of the previous picture whose region did not change, None for the lines
+                 which have to be recognized
+        """
+        if self.previous_lines is None:
+            return [None] * len(regions)
+
+        recognized = [None if region_changed(self.changed, *region) else self.previous_lines.get(region)
+                      for region in regions]
+
+        LOGGER.debug("Reused %d of %d lines from the previous picture.",
+                     sum(words is not None for words in recognized), len(regions))
+        return recognized
+
+    def _get_line_region(self, line_n):
+        coordinates = self.picture.get_line_coordinates(line_n + 1)  # Lines are 1-indexed
+        return coordinates['x'], coordinates['y'], coordinates['width'], coordinates['height']
+
+    def _recognize_lines(self, lines, batch_characters):
+        """
+        Starts recognizing the lines on the line pool.
+
+        :return: List of the futures of the recognized words of the lines, in order
+        """
+        pool = line_pool(max(self.workers, 1))
+
+        if not self.batched:
+            return [pool.submit(self._recognize_line, line) for line in lines]
+
+        segmented = [pool.submit(self._segment_line, line) for line in lines]
+        futures = [Future() for _ in lines]
+
+        # Submitted after the segmentations so the ones it waits for never wait behind it for a worker.
+        pool.submit(self._predict_lines, segmented, futures, batch_characters)
+        return futures
+
+    def _predict_lines(self, segmented, futures, batch_characters):
+        """
+        Sends the characters of the segmented lines to the model in order, in batches of at least batch_characters
+        characters, and resolves the future of every line of a batch with its recognized words.
+        """
+        start = 0
+        characters = 0
+
+        try:
+            for end, segmentation in enumerate(segmented, 1):
+                characters += sum(len(word) for word in segmentation.result())
+
+                if end < len(segmented) and (batch_characters is None or characters < batch_characters):
+                    continue
+
+                if not all(future.set_running_or_notify_cancel() for future in futures[start:end]):
+                    # The caller stopped reading the lines.
+                    for future in segmented[end:]:
+                        future.cancel()
+
+                    return
+
+                segmented_lines = [future.result() for future in segmented[start:end]]
+                predictions = iter(self.ocr.predict_batch([image for line in segmented_lines
+                                                           for word in line for image in word]))
+
+                for line, future in zip(segmented_lines, futures[start:end]):
+                    future.set_result([[next(predictions) for _ in word] for word in line])
+
+                start, characters = end, 0
+        except Exception as error:
+            for future in futures[start:]:
+                if not future.done():
+                    future.set_exception(error)
+
     def _determine_indentation(self, lines):
         """
         Returns a list of indentation distances for each line
@@ -46,25 +209,27 @@ class PictureOCR:
             return []
 
         indents = []
+        # Running sum and count of the x positions of the lines at each indentation level, so that the mean position
+        # of a level can be found without going over all of its lines again.
         indent_locations = []
 
         indents.append(0)
-        indent_locations.append([lines[0].get_x()])
+        indent_locations.append([lines[0].get_x(), 1])
 
         for line_n, line in enumerate(lines[1:]):
             if self._is_before_first_indent(line, indent_locations):
-                indent_locations[0].append(line.get_x())
                 indentation = 0
+                self._add_to_indent(line, indent_locations[indentation])
 
             elif self._is_after_last_indent(line, indent_locations):
-                indent_locations.append([line.get_x()])
+                indent_locations.append([line.get_x(), 1])
                 indentation = len(indent_locations) - 1
 
             else:
                 indentation = self._get_closest_indentation(line, indent_locations)
 
                 if indentation is not None:
-                    indent_locations[indentation].append(line.get_x())
+                    self._add_to_indent(line, indent_locations[indentation])
 
                 else:
                     raise ValueError("Could not determine indentation")
@@ -73,17 +238,25 @@ class PictureOCR:
             indents.append(indentation)
         return indents
 
+    def _add_to_indent(self, line, indent_location):
+        indent_location[0] += line.get_x()
+        indent_location[1] += 1
+
+    def _mean_indent(self, indent_location):
+        total, count = indent_location
+        return total / count
+
     def _is_before_first_indent(self, line, indent_locations):
         """
         Returns whether this line is indented less than the currently least indented line.
         """
-        return line.get_x() < np.mean(indent_locations[0]) - self.indentation_threshold
+        return line.get_x() < self._mean_indent(indent_locations[0]) - self.indentation_threshold
 
     def _is_after_last_indent(self, line, indent_locations):
         """
         Returns whether this line is indented further than the currently most indented line.
         """
-        return line.get_x() > np.mean(indent_locations[-1]) + self.indentation_threshold
+        return line.get_x() > self._mean_indent(indent_locations[-1]) + self.indentation_threshold
 
     def _get_closest_indentation(self, line, indent_locations):
         """
@@ -92,9 +265,11 @@ class PictureOCR:
         distance = sys.maxsize
         indentation = None
 
-        for idx, indent in enumerate(indent_locations):
-            if abs(np.mean(indent) - line.get_x()) < distance:
-                distance = abs(np.mean(indent) - line.get_x())
+        for idx, indent_location in enumerate(indent_locations):
+            indent_distance = abs(self._mean_indent(indent_location) - line.get_x())
+
+            if indent_distance < distance:
+                distance = indent_distance
                 indentation = idx
 
         return indentation
@@ -106,8 +281,7 @@ class PictureOCR:
 
         coded_words = []
         word_variances = {}
-        for idx, word in enumerate(words):
-            characters = word.get_segments()
+        for idx, characters in enumerate(words):
             code_word, poss_chars = self._merge_code_characters(characters)
 
             word_variances[idx] = poss_chars
@@ -131,16 +305,13 @@ class PictureOCR:
         """
         Merges all of the words into a line of code
 
-        :param characters: List of characters to parse
+        :param characters: List of predicted characters, each is the most probable character and its alternatives
         :return:
         """
 
         coded_chars = []
         char_variances = {}
-        for idx, char in enumerate(characters):
-            image = char.get_segments()
-            code_char, other_poss_chars = self.ocr.predict(image)
-
+        for idx, (code_char, other_poss_chars) in enumerate(characters):
             char_variances[idx] = other_poss_chars
             coded_chars.append(code_char)
 
@@ -0,0 +1,16 @@
+class PossibleChars(list):
+    """
+    Possible characters of one position of a line, ordered from the most probable one, together with their
+    probabilities. It is still a list of the characters so everything which only needs the characters can ignore the
+    probabilities.
+    """
+
+    def __init__(self, chars=(), probabilities=None):
+        super().__init__(chars)
+        self.probabilities = list(probabilities) if probabilities is not None else None
+
+    def copy(self):
+        return PossibleChars(self, self.probabilities)
+
+    def __repr__(self):
+        return 'PossibleChars({}, {})'.format(list(self), self.probabilities)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from ..ocr.possible_chars import PossibleChars
+
+DEFAULT_CACHE_SIZE = 10000
+
+# How many new predictions are stored in the shared database before it is trimmed back to max_size.
+TRIM_INTERVAL = 100
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of character predictions keyed by a hash of the character image. If a path is given, predictions
+    are also stored in an sqlite database at that path so that they are shared between worker processes.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, path=None, namespace=''):
+        self.max_size = max_size
+        self.namespace = namespace.encode('utf-8')
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = self._connect(path) if path else None
+        self._stored = 0
+
+    def _connect(self, path):
+        db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, prediction TEXT, used REAL)')
+        return db
+
+    def key(self, char):
+        """
+        Content address of the character image, identical images get the same key no matter where they come from.
+        """
+        char = np.ascontiguousarray(char).reshape(28, 28)
+        return hashlib.md5(self.namespace + char.dtype.str.encode('utf-8') + char.tobytes()).hexdigest()
+
+    def get(self, key):
+        """
+        :return: The cached (most probable character, PossibleChars) prediction or None if it is not cached
+        """
+        with self._lock:
+            prediction = self._entries.get(key)
+
+            if prediction is not None:
+                self._entries.move_to_end(key)
+            elif self._db:
+                prediction = self._get_shared(key)
+
+                if prediction is not None:
+                    self._add(key, prediction)
+
+            if prediction is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            best, possible, probabilities = prediction
+            return best, PossibleChars(possible, probabilities)
+
+    def put(self, key, prediction):
+        if self.max_size <= 0:
+            return
+
+        best, possible = prediction
+        probabilities = getattr(possible, 'probabilities', None)
+        probabilities = tuple(probabilities) if probabilities is not None else None
+
+        with self._lock:
+            self._add(key, (best, tuple(possible), probabilities))
+
+            if self._db:
+                self._put_shared(key, (best, list(possible), probabilities))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0}
+
+    def _add(self, key, prediction):
+        self._entries[key] = prediction
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key):
+        row = self._db.execute('SELECT prediction FROM predictions WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        self._db.execute('UPDATE predictions SET used = ? WHERE key = ?', (time.time(), key))
+        # Predictions stored before the probabilities were kept only have the characters.
+        best, possible, *probabilities = json.loads(row[0])
+        probabilities = probabilities[0] if probabilities else None
+        return best, tuple(possible), tuple(probabilities) if probabilities is not None else None
+
+    def _put_shared(self, key, prediction):
+        self._db.execute('INSERT OR REPLACE INTO predictions (key, prediction, used) VALUES (?, ?, ?)',
+                         (key, json.dumps(prediction), time.time()))
+        self._stored += 1
+
+        if self._stored % TRIM_INTERVAL == 0:
+            self._db.execute('DELETE FROM predictions WHERE key NOT IN '
+                             '(SELECT key FROM predictions ORDER BY used DESC LIMIT ?)', (self.max_size,))
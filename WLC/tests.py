@@ -1,4 +1,15 @@
+import io
+import subprocess
+import sys
+import tarfile
+from collections import namedtuple
+
+import numpy as np
+
 from WLC.benchmark import run_benchmarks
+from WLC.code_executor.container_pool import ContainerPool
+from WLC.code_executor.error_check_store import ErrorCheckStore
+from WLC.ocr.ocr import OCR
 
 MINIMUM_ACCURACY = 80
 
@@ -6,3 +17,86 @@ MINIMUM_ACCURACY = 80
 def test_benchmarks():
     accuracy = run_benchmarks()
     assert accuracy > MINIMUM_ACCURACY
+
+
+def test_numpy_engine_matches_keras():
+    chars = np.random.RandomState(0).randint(0, 256, (64, 28, 28, 1)).astype('float32') / 255
+
+    keras_predictions = OCR('keras').model.predict(chars)
+    numpy_predictions = OCR('numpy').model.predict(chars)
+
+    assert np.allclose(keras_predictions, numpy_predictions, atol=1e-5)
+
+
+ExecResult = namedtuple('ExecResult', ['exit_code', 'output'])
+
+
+class FakeContainer:
+    """
+    Runs the files copied into it with the local interpreter instead of in Docker.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.runs = 0
+        self.removed = False
+
+    def put_archive(self, path, data):
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for member in tar.getmembers():
+                self.files[member.name] = tar.extractfile(member).read()
+
+    def exec_run(self, cmd, workdir=None, user=None):
+        timeout, program = int(cmd[3]), cmd[4:]
+        self.runs += 1
+        code = self.files[program[-1]]
+
+        try:
+            process = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     timeout=timeout)
+            # Programs killed by a signal exit with 128 + the signal in a shell, like they do in a container.
+            return ExecResult(128 - process.returncode if process.returncode < 0 else process.returncode,
+                              process.stdout)
+        except subprocess.TimeoutExpired as expired:
+            return ExecResult(137, expired.stdout or b'')
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.containers = self
+        self.started = []
+
+    def run(self, image, command, **kwargs):
+        assert kwargs['network_disabled'] and kwargs['cap_drop'] == ['ALL'] and kwargs['nano_cpus']
+        self.started.append(FakeContainer())
+        return self.started[-1]
+
+
+def test_container_pool():
+    client = FakeDockerClient()
+    pool = ContainerPool(client, 'python', 'main.py', ['python', 'main.py'], size=2, timeout=1)
+
+    assert pool.run('print("a \\"quoted\\" string")') == ('a "quoted" string\n', None)
+    assert pool.run('while True: pass')[1] == 'timeout'
+    assert pool.run('import os, signal\nos.kill(os.getpid(), signal.SIGKILL)')[1] == 'killed'
+
+    pool.close()
+    assert all(container.removed for container in client.started)
+    assert sorted(container.runs for container in client.started)[-2:] == [1, 1]
+
+
+def test_error_check_store(tmp_path):
+    # Two stores on one database stand for two worker processes.
+    store, other = ErrorCheckStore(str(tmp_path / 'errors.db')), ErrorCheckStore(str(tmp_path / 'errors.db'))
+
+    earlier = store.submit('key', {'errorsPending': True})
+    later = other.submit('key', {'errorsPending': True})
+    store.finish('key', earlier, {'errorsPending': False, 'errors': ['earlier']})
+    assert other.get('key') == {'errorsPending': True}
+
+    other.finish('key', later, {'errorsPending': False, 'errors': ['later']})
+    assert store.get('key') == {'errorsPending': False, 'errors': ['later']}
+    assert store.get('missing') is None
@@ -1,6 +1,24 @@
+import inspect
+
+
 class Singleton(type):
+    """
+    Creates a single instance of the class for each combination of constructor arguments. The arguments are bound to
+    the signature of the constructor with their defaults first, so OCR() and OCR(engine=None) share one instance.
+    Classes which resolve some arguments themselves can define a normalize_arguments class method that takes the bound
+    arguments as keywords and returns the ones to create the instance with.
+    """
     _instances = {}
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+        # The signature of the class itself would be the one of this __call__.
+        arguments = inspect.signature(cls.__init__).bind(None, *args, **kwargs)
+        arguments.apply_defaults()
+        arguments = dict(list(arguments.arguments.items())[1:])
+
+        if hasattr(cls, 'normalize_arguments'):
+            arguments = cls.normalize_arguments(**arguments)
+
+        key = (cls, tuple(sorted(arguments.items())))
+        if key not in cls._instances:
+            cls._instances[key] = super(Singleton, cls).__call__(**arguments)
+        return cls._instances[key]
@@ -1,6 +1,8 @@
 import hashlib
 import json
+import logging
 import os
+import tempfile
 from urllib.request import urlopen
 
 import numpy as np
@@ -9,16 +11,43 @@ import sys
 from cv2 import cv2, IMREAD_COLOR
 from ttldict import TTLOrderedDict
 
-from flask import Flask, render_template, g
+from flask import Flask, Response, render_template, g, stream_with_context
 from flask import request
 from image_segmentation.picture import Picture
 from image_segmentation.preprocessor import Preprocessor
 
 from .code_executor.code_executor import CodeExecutor
+from .code_executor.error_check_store import ErrorCheckStore
+from .ocr.ocr import preload_model
 from .utils.azure import WLCAzure
 
+try:
+    from uwsgidecorators import postfork
+except ImportError:  # Not running under uwsgi
+    postfork = None
+
+LOGGER = logging.getLogger()
+
+# Background error checks which have not started yet beyond this number are cancelled, oldest first, so the checks of
+# frames nobody is going to fetch do not pile up in front of the linter.
+MAXIMUM_PENDING_ERROR_CHECKS = 8
+
+# Database of the responses of the background error checks, shared by the worker processes so that /api/errors does not
+# have to reach the worker which runs the check.
+ERROR_CHECK_PATH = os.environ.get('ERROR_CHECK_PATH', os.path.join(tempfile.gettempdir(), 'wlc_error_checks.db'))
+
 app = Flask(__name__)
 image_cache = TTLOrderedDict(default_ttl=30 * 60)
+# Fix states of the uploaded images by language and image key, so a retake or another upload of the same board only
+# fixes the changed lines.
+fix_states = TTLOrderedDict(default_ttl=30 * 60)
+# Futures of the errors of the images whose code is checked in the background by this process after a tiered request.
+error_checks = TTLOrderedDict(default_ttl=30 * 60)
+error_check_store = ErrorCheckStore(ERROR_CHECK_PATH)
+
+if postfork:
+    # Every uwsgi worker loads its own model right after it is forked, before it starts accepting requests.
+    postfork(preload_model)
 
 
 @app.route("/")
@@ -30,34 +59,152 @@ def index():
 @app.route("/api/upload_image", methods=['POST', 'GET'])
 def api_upload_image():
     if request.method == 'POST':
-        file = request.files['file']
-        img_array = np.asarray(bytearray(file.read()), dtype=np.uint8)
-        img = cv2.imdecode(img_array, IMREAD_COLOR)
-
-        height, width, _ = img.shape
-        pic = Picture(img, 0, 0, width, height, None)
-        key = hashlib.md5(img.tobytes()).hexdigest()
-        image_cache[key] = img
+        pic, key = _read_uploaded_image(request.files['file'])
 
         g.pic = pic
         g.hashed = key
 
         executor = get_executor(request)
-        code, fixed_code, result, errors = executor.execute_code_img(pic)
+        *_, processed = executor.stream_picture(pic, _get_previous_state(key))
+        fix_states[_fix_state_key(key)] = processed['state']
 
-        if len(errors) == 0 and 'template' in request.args:
-            test_results = executor.execute_tests(code, request.args.get('template'))
-        else:
-            test_results = []
+        code, fixed_code = processed['unfixed'], processed['fixed']
+        result, errors = executor.execute_code(fixed_code, _is_tiered())
 
-        ar = _get_ar_coordinates(pic, errors)
+        return json.dumps(_get_upload_response(executor, pic, key, code, fixed_code, result, errors,
+                                               processed['truncated']))
+    else:
+        return render_template('upload_test.html')
+
+
+@app.route("/api/stream_image", methods=['POST'])
+def api_stream_image():
+    """
+    Same as upload_image but the response is streamed as newline delimited JSON. There is one object for every line
+    as soon as it is recognized ('line', 'indent', 'unfixed') and a final one with the same fields as upload_image.
+    """
+    pic, key = _read_uploaded_image(request.files['file'])
+
+    g.pic = pic
+    g.hashed = key
+
+    executor = get_executor(request)
+    previous_state = _get_previous_state(key)
+
+    def generate():
+        processed = None
+
+        for processed in executor.stream_picture(pic, previous_state):
+            if 'line' in processed:
+                yield json.dumps(processed) + "\n"
+
+        fix_states[_fix_state_key(key)] = processed['state']
+
+        code, fixed_code = processed['unfixed'], processed['fixed']
+        result, errors = executor.execute_code(fixed_code, _is_tiered())
+
+        yield json.dumps(_get_upload_response(executor, pic, key, code, fixed_code, result, errors,
+                                              processed['truncated'])) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _read_uploaded_image(file):
+    img_array = np.asarray(bytearray(file.read()), dtype=np.uint8)
+    img = cv2.imdecode(img_array, IMREAD_COLOR)
+
+    height, width, _ = img.shape
+    pic = Picture(img, 0, 0, width, height, None)
+    key = hashlib.md5(img.tobytes()).hexdigest()
+    image_cache[key] = img
+
+    return pic, key
+
+
+def _get_previous_state(key):
+    """
+    :return: Fix state of the image given by the 'previous' argument, an earlier picture of the same board, or of the
+             same image if it was uploaded before. None if neither is cached.
+    """
+    for previous in (request.args.get('previous'), key):
+        # get instead of checking the key first, the state may expire in between.
+        state = fix_states.get(_fix_state_key(previous)) if previous else None
+
+        if state is not None:
+            return state
 
-        response = {'unfixed': code, 'fixed': fixed_code, 'result': str(result), 'errors': errors, 'key': key,
-                    'ar': ar, 'testResults': test_results}
+    return None
 
-        return json.dumps(response)
+
+def _fix_state_key(key):
+    """
+    :return: Key of the fix state of the image in the language of the request, the matches of a state only mean
+             something to the fixer of the language which made it
+    """
+    return request.args.get('language', 'python3').lower(), key
+
+
+def _is_tiered():
+    """
+    :return: Whether the request only wants the errors which are found instantly in its response, the rest of the
+             errors are then fetched from /api/errors once they are checked
+    """
+    return 'tiered' in request.args
+
+
+def _check_errors_later(executor, pic, key, code):
+    """
+    Starts the slower error checks of the code in the background and keeps them under the image key. The checks of an
+    earlier upload of the same image or of the previous picture of the board are superseded and cancelled.
+
+    :return: Whether there are errors left to fetch from /api/errors
+    """
+    future = executor.check_errors_in_background(code)
+
+    if future is None:
+        return False
+
+    for superseded in (key, request.args.get('previous')):
+        # get instead of checking the key first, the check may expire in between.
+        check = error_checks.get(superseded) if superseded else None
+
+        if check is not None:
+            check.cancel()
+
+    # Assigning an existing key keeps its old position, the new check has to be the newest one or it would be the first
+    # to be cancelled below.
+    try:
+        del error_checks[key]
+    except KeyError:
+        pass
+
+    error_checks[key] = future
+    check_id = error_check_store.submit(key, {'key': key, 'errorsPending': True, 'errors': [], 'ar': None})
+
+    def store_response(done):
+        error_check_store.finish(key, check_id, _error_check_response(pic, key, done))
+
+    future.add_done_callback(store_response)
+
+    pending = [check for check in error_checks.values() if not check.done()]
+
+    for check in pending[:-MAXIMUM_PENDING_ERROR_CHECKS]:
+        check.cancel()
+
+    return True
+
+
+def _get_upload_response(executor, pic, key, code, fixed_code, result, errors, truncated=()):
+    if len(errors) == 0 and 'template' in request.args:
+        test_results = executor.execute_tests(code, request.args.get('template'))
     else:
-        return render_template('upload_test.html')
+        test_results = []
+
+    ar = _get_ar_coordinates(pic, errors)
+    pending = _is_tiered() and _check_errors_later(executor, pic, key, fixed_code)
+
+    return {'unfixed': code, 'fixed': fixed_code, 'result': str(result), 'errors': errors, 'key': key,
+            'ar': ar, 'testResults': test_results, 'truncated': list(truncated), 'errorsPending': pending}
 
 
 @app.after_request
@@ -87,7 +234,7 @@ def api_resubmit_code():
         g.key = key
 
         executor = get_executor(request)
-        result, errors = executor.execute_code(code)
+        result, errors = executor.execute_code(code, _is_tiered())
 
         if len(errors) == 0 and 'template' in request.args:
             test_results = executor.execute_tests(code, request.args.get('template'))
@@ -104,13 +251,47 @@ def api_resubmit_code():
         pic = Preprocessor().process(pic)
         pic.get_segments()
         ar = _get_ar_coordinates(pic, errors)
+        pending = _is_tiered() and _check_errors_later(executor, pic, key, code)
 
         return json.dumps({'result': str(result), 'errors': errors, 'ar': ar, 'key': key,
-                           'testResults': test_results})
+                           'testResults': test_results, 'errorsPending': pending})
     else:
         return render_template('resubmit_test.html')
 
 
+@app.route("/api/errors", methods=['GET'])
+def api_errors():
+    """
+    Errors found by the background checks of a tiered upload_image, stream_image or resubmit_code request, fetched by
+    the key of the image from any worker process. Pending stays true until the checks are done, the errors include the
+    instant ones.
+    """
+    key = request.args.get('key')
+    response = error_check_store.get(key) if key else None
+
+    if response is None:
+        return json.dumps({'key': key, 'error': 'No error check for this key'}), 404
+
+    return json.dumps(response)
+
+
+def _error_check_response(pic, key, future):
+    """
+    :return: Response of /api/errors for the finished check of the image
+    """
+    if future.cancelled():
+        return {'key': key, 'errorsPending': False, 'error': 'Error check was superseded by a newer one', 'errors': [],
+                'ar': None}
+
+    try:
+        errors = future.result()
+    except Exception:
+        LOGGER.exception("Error check of %s failed.", key)
+        return {'key': key, 'errorsPending': False, 'error': 'Error check failed', 'errors': [], 'ar': None}
+
+    return {'key': key, 'errorsPending': False, 'errors': errors, 'ar': _get_ar_coordinates(pic, errors)}
+
+
 @app.route("/api/template", methods=['POST'])
 def api_template():
     if request.method == 'POST':
@@ -176,4 +357,5 @@ def get_executor(request):
 
 if __name__ == "__main__":
     # Only for debugging while developing
+    preload_model()
     app.run(host='0.0.0.0', debug=True, port=80)